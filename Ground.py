@@ -1,13 +1,18 @@
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 from texture import TexturedMesh
-from texture import Texture
+from texture import Texture, load_texture, decoded, PRIORITY_LOW, PRIORITY_HIGH
 from PIL import Image
 import numpy as np
 from math import floor
 import operator
 from mesh import VertexArray
 from shader import Shader
+from render import state
+from startup import startup
+from cache import assets
+from transform import bounding_sphere
+from terrain import build_terrain, HeightField, chunk_indices, chunk_lods, edge_steps
 
 G_VERT = """#version 330 core
 
@@ -67,15 +72,19 @@ class Ground:
     """
     non flat ground in the scene
     """
-    def __init__(self, origin, widthScale, heightScale):
+    culls = True    # chunks culled and counted one by one
+    def __init__(self, origin, widthScale, heightScale, chunkSize=32, lods=4, lodDistance=150):
         """
-        init the mesh that represents the ground
+        init the mesh that represents the ground, split in chunks of
+        chunkSize*chunkSize cells (a power of two) drawn with lods levels of
+        detail, the level increasing each time the distance doubles past lodDistance
         """
 
-        #Textures and height map
-        self.texture = Texture("ground/ground.jpg")
-        self.normalMap = Texture("ground/normal.jpg")
-        self.heightMap = Image.open("ground/heightMap.png")
+        #Textures and height map, the ground fills most of the view and its
+        #normal map is the first to lose detail when over the texture budget
+        self.texture = load_texture("ground/ground.jpg", priority=PRIORITY_HIGH)
+        self.normalMap = load_texture("ground/normal.jpg", priority=PRIORITY_LOW)
+        self.heightMap = decoded("ground/heightMap.png")
         
         self.shader = Shader(G_VERT, G_FRAG)
         
@@ -83,121 +92,124 @@ class Ground:
         self.widthScale = widthScale
         self.heightScale = heightScale
         
-        #To access heights for the dinosaur.
-        self.heights = {}
-
-        #Creating the vertices and attributes
-        self.sizeX = self.heightMap.size[0]
-        self.sizeZ = self.heightMap.size[1]
-
-        self.vertices, self.texels, self.faces = [], [], []
-        self.normals = [np.array((0, 0, 0), dtype=float)]*self.sizeX*self.sizeZ
-        self.tangents = [np.array((0, 0, 0), dtype=float)]*self.sizeX*self.sizeZ
-        self.bitangents = [np.array((0, 0, 0), dtype=float)]*self.sizeX*self.sizeZ
-        
-        for z in range(self.sizeZ):
-            for x in range(self.sizeX):
-                
-                #Vertex
-                vertex = ((self.origin[0]+x)*self.widthScale,
-                    self.origin[1] + self.heightMap.getpixel((x, z))[0]*self.heightScale,
-                    (self.origin[2]+z)*self.widthScale)
-                self.vertices.append(vertex)
-
-                #Updating height info
-                self.heights[(x, z)] = self.origin[1] + self.heightMap.getpixel((x, z))[0]*self.heightScale
-                
-                #Texel
-                self.texels.append((x%2, z%2))
-
-
-        #Creating the faces
-        for z in range(self.sizeZ-1):
-            for x in range(self.sizeX-1):
-                self.faces.append(
-                    (x + z*self.sizeX, x + (z+1)*self.sizeX, (x+1) + z*self.sizeX)
-                )
-                self.faces.append(
-                    (x + (z+1)*self.sizeX, (x+1) + (z+1)*self.sizeX, (x+1) + z*self.sizeX)
-                )
-
-        #Computing normals, tangent and bitangents for normal mapping purpose.
-        for triangle in self.faces:
-
-            uFace = np.array(self.vertices[triangle[1]]) - np.array(self.vertices[triangle[0]])
-            vFace = np.array(self.vertices[triangle[2]]) - np.array(self.vertices[triangle[0]])
-
-            normal = (uFace[1]*vFace[2]-uFace[2]*vFace[1],
-                      uFace[2]*vFace[0]-uFace[0]*vFace[2],
-                      uFace[0]*vFace[1]-uFace[1]*vFace[0])
-
-            #UV delta for tangent and bitangent
-            deltaUV1 = np.array(self.texels[triangle[1]]) - np.array(self.texels[triangle[0]])
-            deltaUV2 = np.array(self.texels[triangle[2]]) - np.array(self.texels[triangle[0]])
-
-            #Computing tangents and bitangent
-            diff = deltaUV1[0] * deltaUV2[1] - deltaUV1[0] * deltaUV2[0]
-            if(diff==0):
-                r = 1
-            else:
-                r = 1/diff;
-            tangent = (uFace * deltaUV2[1] - vFace * deltaUV1[1])*r;
-            bitangent = (vFace * deltaUV1[0] - uFace * deltaUV2[0])*r;
-
-            #Put the mean for normal, tangent and bitangent for each vertex. Will be normalized in the shader.
-            for index in triangle:
-                self.normals[index] += normal
-                self.tangents[index] += tangent
-                self.bitangents[index] += bitangent
-        
-        self.array = VertexArray([np.array(self.vertices), np.array(self.texels), self.normals, self.tangents, self.bitangents],
-            np.array(self.faces, dtype=np.uint32)
-            )
-
-    def draw(self, projection, view, model, win=None, **_kwargs):
+        #Creating the vertices, attributes and faces from the height map
+        pixels = np.atleast_3d(np.asarray(self.heightMap))[:, :, 0]
+        self.sizeZ, self.sizeX = pixels.shape
+
+        with startup.phase('terrain'):
+            (self.vertices, self.texels, self.normals, self.tangents,
+             self.bitangents, self.faces) = build_terrain(pixels, self.origin,
+                                                           self.widthScale, self.heightScale)
+
+        #To access heights for the dinosaur and the trees.
+        self.heightField = HeightField(self.vertices[:, 1].reshape(pixels.shape),
+                                       self.origin, self.widthScale, self.heightScale)
+
+        #Splitting the terrain in chunks, last ones padded with the map border
+        self.chunkSize, self.lods, self.lodDistance = chunkSize, lods, lodDistance
+        self.chunksZ = -(-(self.sizeZ - 1) // chunkSize)
+        self.chunksX = -(-(self.sizeX - 1) // chunkSize)
+        attributes = [a.reshape(self.sizeZ, self.sizeX, -1) for a in
+                      (self.vertices, self.texels, self.normals, self.tangents, self.bitangents)]
+        self.chunks = []
+        k = np.arange(chunkSize + 1)
+        for cz in range(self.chunksZ):
+            rows = np.minimum(cz*chunkSize + k, self.sizeZ - 1)
+            for cx in range(self.chunksX):
+                cols = np.minimum(cx*chunkSize + k, self.sizeX - 1)
+                chunk = [a[np.ix_(rows, cols)].reshape(-1, a.shape[2]) for a in attributes]
+                self.chunks.append(VertexArray(chunk))
+
+        #Bounding spheres of the ground and of its chunks, for culling
+        self.bounds = bounding_sphere(self.vertices)
+        self.centers = np.array([np.append(chunk.bounds[0], 1) for chunk in self.chunks])
+        self.radii = np.array([chunk.bounds[1] for chunk in self.chunks])
+
+        #Index buffers shared by all chunks, one per lod and neighbour lods
+        self.patterns = {}
+        for lod in range(lods):
+            self.pattern(lod, (2**lod,)*4)
+        self.drawnTriangles = 0
+
+    def pattern(self, lod, edges):
         """
-        draws the ground using a normal map
+        element buffer and index count of a chunk drawn at lod with the given
+        neighbour edge steps, built the first time it is needed
         """
-        GL.glUseProgram(self.shader.glid)
+        key = (int(lod), tuple(int(edge) for edge in edges))
+        if key not in self.patterns:
+            faces = chunk_indices(self.chunkSize, 2**lod, key[1])
+            glid = GL.glGenBuffers(1)
+            state.bind_vertex_array(0)  # do not change the index buffer of a chunk
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, glid)
+            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, faces, GL.GL_STATIC_DRAW)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+            startup.uploaded(faces.nbytes)
+            self.patterns[key] = glid, faces.size
+        return self.patterns[key]
+
+    def chunkLods(self, view, model):
+        """ (chunksZ, chunksX) lods from the distance of the chunks to the camera """
+        centers = (view @ model @ self.centers.T)[:3]
+        lods = chunk_lods(np.linalg.norm(centers, axis=0), self.lodDistance, self.lods)
+        return lods.reshape(self.chunksZ, self.chunksX)
+
+    def draw(self, projection, view, model, win=None, frustum=None, **_kwargs):
+        """
+        draws the ground using a normal map, skipping the chunks outside of
+        the view frustum if given
+        """
+        state.use_program(self.shader.glid)
 
         # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        self.shader.set_mat4('modelviewprojection', projection @ view @ model)
 
         #modelview matrix
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelView')
-        GL.glUniformMatrix4fv(loc, 1, True, view @ model)
+        self.shader.set_mat4('modelView', view @ model)
 
         # Texture and normal mapping
-        loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
-
-        loc = GL.glGetUniformLocation(self.shader.glid, 'normalMap')
-        GL.glActiveTexture(GL.GL_TEXTURE1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.normalMap.glid)
-        GL.glUniform1i(loc, 1)
-
-        #Draw the vertex array
-        self.array.draw(GL.GL_TRIANGLES)
-
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
+        self.shader.set_int('diffuseMap', 0)
+        state.bind_texture(self.texture.glid, 0)
+
+        self.shader.set_int('normalMap', 1)
+        state.bind_texture(self.normalMap.glid, 1)
+
+        #Draw each chunk at its lod, stitched to its neighbours
+        lods = self.chunkLods(view, model)
+        edges = edge_steps(lods).reshape(-1, 4)
+        visible = np.ones(len(self.chunks), dtype=bool)
+        if frustum is not None:
+            scale_factor = np.linalg.norm(model[:3, :3], axis=0).max()
+            visible = frustum.visible_spheres((model @ self.centers.T)[:3].T,
+                                              self.radii * scale_factor)
+        self.drawnTriangles = 0
+        for chunk, lod, edge, shown in zip(self.chunks, lods.ravel(), edges, visible):
+            if not shown:
+                continue
+            glid, size = self.pattern(lod, edge)
+            state.bind_vertex_array(chunk.glid)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, glid)
+            GL.glDrawElements(GL.GL_TRIANGLES, size, GL.GL_UNSIGNED_INT, None)
+            state.count_draw(size)
+            self.drawnTriangles += size // 3
 
     def on_key(self, _win, key, _scancode, action, _mods):
         """
         catch no event
         """
         pass
+
+    def __del__(self):
+        GL.glDeleteBuffers(len(self.patterns), [glid for glid, _ in self.patterns.values()])
+        assets.release(self.texture)
+        assets.release(self.normalMap)
         
 
     def getHeight(self, x, z):
-        return self.heights[(x - self.origin[0], z - self.origin[2])]
+        return self.heightField.get_heights(x, z)
 
     def getSlope(self, x0, z0, x1, z1):
-        return - np.arcsin((self.getHeight(x1, z1) - self.getHeight(x0, z0))/(255*self.heightScale))/np.pi * 180
+        return self.heightField.get_slopes(x0, z0, x1, z1)
 
     def iterPos(self):
         """
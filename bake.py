@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Precompiled scene files, baked offline from pyassimp and memory mapped at
+runtime. A baked file (model file name + '.bake') holds a json header
+followed by 16 bytes aligned raw arrays: float32 vertex streams, uint32
+faces, flat bone weights and offsets, node transforms and animation keys.
+Usage: python3 bake.py [files], by default every model of the scene.
+"""
+import os
+import sys
+import json
+import glob
+
+import numpy as np
+import pyassimp
+import pyassimp.errors
+
+from startup import startup
+
+# assimp post-processing applied to every loaded file
+POSTPROCESS = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
+
+MAGIC = b'BAKE0001'
+ALIGN = 16
+DEFAULT_FILES = ['dino/*.dae', 'tree/tree.obj', 'skybox/skybox.obj']
+
+
+# ------------  Scene data, common to parsed and baked files ------------------
+class BakedMesh:
+    """ arrays of one mesh, texcoords and bones being optional """
+    def __init__(self, vertices, normals, faces, material, texcoords=None,
+                 bone_names=(), bone_offsets=None, bone_entries=None):
+        self.vertices, self.normals, self.faces = vertices, normals, faces
+        self.material, self.texcoords = material, texcoords
+        self.bone_names, self.bone_offsets = list(bone_names), bone_offsets
+        self.bone_entries = bone_entries    # (vertex id, bone id, weight) rows
+
+
+class BakedNode:
+    """ scene hierarchy node, parent being an index in the node list or -1 """
+    def __init__(self, name, parent, transform, meshes):
+        self.name, self.parent, self.transform = name, parent, transform
+        self.meshes = list(meshes)          # indices in the mesh list
+
+
+class BakedScene:
+    """ meshes, materials, depth first node list and first animation channels """
+    def __init__(self, option, meshes, materials, nodes, channels):
+        self.option, self.meshes, self.materials = option, meshes, materials
+        self.nodes = nodes
+        # node name -> (position, rotation, scaling) (times, values) key pairs
+        self.channels = channels
+
+
+def parse_scene(file, option):
+    """ convert a file parsed by pyassimp to a BakedScene, None on error """
+    try:
+        scene = pyassimp.load(file, option)
+    except pyassimp.errors.AssimpError:
+        print('ERROR: pyassimp unable to load', file)
+        return None
+
+    meshes = []
+    for mesh in scene.meshes:
+        bone_entries = np.array([(entry.vertexid, bone_id, entry.weight)
+                                 for bone_id, bone in enumerate(mesh.bones)
+                                 for entry in bone.weights], np.float32).reshape(-1, 3)
+        meshes.append(BakedMesh(
+            np.array(mesh.vertices, np.float32), np.array(mesh.normals, np.float32),
+            np.array(mesh.faces, np.uint32), mesh.materialindex,
+            np.array(mesh.texturecoords[0][:, :2], np.float32) if mesh.texturecoords.size else None,
+            [bone.name for bone in mesh.bones],
+            np.array([bone.offsetmatrix for bone in mesh.bones], np.float32).reshape(-1, 4, 4),
+            bone_entries))
+
+    materials = []
+    for mat in scene.materials:
+        tokens = dict(reversed(list(mat.properties.items())))
+        materials.append(dict(
+            diffuse=[float(c) for c in tokens['diffuse']] if 'diffuse' in tokens else None,
+            file=tokens.get('file')))
+
+    nodes = []
+    mesh_index = {id(mesh): index for index, mesh in enumerate(scene.meshes)}
+
+    def add_node(pyassimp_node, parent):
+        """ depth first listing of the pyassimp hierarchy """
+        nodes.append(BakedNode(pyassimp_node.name, parent,
+                               np.array(pyassimp_node.transformation, np.float32),
+                               [mesh_index[id(mesh)] for mesh in pyassimp_node.meshes]))
+        index = len(nodes) - 1
+        for child in pyassimp_node.children:
+            add_node(child, index)
+    add_node(scene.rootnode, -1)
+
+    channels = scene_channels(scene)
+    pyassimp.release(scene)
+    return BakedScene(option, meshes, materials, nodes, channels)
+
+
+def scene_channels(scene):
+    """ channels of the first animation of a pyassimp scene, as used by the
+        skinned loaders, by node name """
+    def keys(assimp_keys, ticks_per_second):
+        """ (times in seconds, values) arrays of assimp keys """
+        times = np.array([key.time / ticks_per_second for key in assimp_keys], np.float32)
+        values = np.array([key.value for key in assimp_keys], np.float32)
+        return times, values.reshape(len(times), -1)
+
+    channels = {}
+    if scene.animations:
+        anim = scene.animations[0]
+        for channel in anim.channels:
+            # (pyassimp name storage bug, bytes instead of str => convert it)
+            channels[channel.nodename.data.decode('utf-8')] = (
+                keys(channel.positionkeys, anim.tickspersecond),
+                keys(channel.rotationkeys, anim.tickspersecond),
+                keys(channel.scalingkeys, anim.tickspersecond))
+    return channels
+
+
+def parse_channels(file, option=0):
+    """ first animation channels of a file parsed by pyassimp, None on error.
+        No mesh post-processing by default, clips only need the keys """
+    try:
+        scene = pyassimp.load(file, option)
+    except pyassimp.errors.AssimpError:
+        print('ERROR: pyassimp unable to load', file)
+        return None
+    channels = scene_channels(scene)
+    pyassimp.release(scene)
+    return channels
+
+
+# ------------  Binary container -----------------------------------------------
+def baked_path(file):
+    """ name of the baked version of a model file """
+    return file + '.bake'
+
+
+def write_scene(path, scene):
+    """ write a BakedScene as a header and aligned raw arrays """
+    arrays = []
+
+    def store(array):
+        """ index of an array in the container, None for no array """
+        if array is None:
+            return None
+        arrays.append(np.ascontiguousarray(array))
+        return len(arrays) - 1
+
+    header = dict(option=scene.option, materials=scene.materials, meshes=[
+        dict(vertices=store(mesh.vertices), normals=store(mesh.normals),
+             faces=store(mesh.faces), material=mesh.material,
+             texcoords=store(mesh.texcoords), bone_names=mesh.bone_names,
+             bone_offsets=store(mesh.bone_offsets), bone_entries=store(mesh.bone_entries))
+        for mesh in scene.meshes], nodes=[
+        dict(name=node.name, parent=node.parent, transform=store(node.transform),
+             meshes=node.meshes) for node in scene.nodes], channels={
+        name: [[store(times), store(values)] for times, values in trs]
+        for name, trs in scene.channels.items()})
+
+    end, table = 0, []
+    for array in arrays:
+        table.append((end, array.dtype.str, array.shape))
+        end += -(-array.nbytes // ALIGN) * ALIGN
+    header['arrays'] = table
+    text = json.dumps(header).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(text)) // ALIGN) * ALIGN
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC + np.uint64(len(text)).tobytes() + text)
+        for (offset, _, _), array in zip(table, arrays):
+            file.seek(start + offset)
+            file.write(array.tobytes())
+        file.truncate(start + end)
+
+
+def read_scene(path):
+    """ BakedScene whose arrays are read only views of the memory mapped file """
+    data = np.memmap(path, np.uint8, mode='r')
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        return None
+    length = int(data[len(MAGIC):len(MAGIC) + 8].view(np.uint64)[0])
+    header = json.loads(bytes(data[len(MAGIC) + 8:len(MAGIC) + 8 + length]).decode('utf-8'))
+    start = -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+
+    def array(index):
+        """ zero copy view of an array of the container """
+        if index is None:
+            return None
+        offset, dtype, shape = header['arrays'][index]
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        begin = start + offset
+        return data[begin:begin + count * dtype.itemsize].view(dtype).reshape(shape)
+
+    meshes = [BakedMesh(array(m['vertices']), array(m['normals']), array(m['faces']),
+                        m['material'], array(m['texcoords']), m['bone_names'],
+                        array(m['bone_offsets']), array(m['bone_entries']))
+              for m in header['meshes']]
+    nodes = [BakedNode(n['name'], n['parent'], array(n['transform']), n['meshes'])
+             for n in header['nodes']]
+    channels = {name: tuple((array(times), array(values)) for times, values in trs)
+                for name, trs in header['channels'].items()}
+    return BakedScene(header['option'], meshes, header['materials'], nodes, channels)
+
+
+def load_scene(file, option):
+    """ scene of a model file, memory mapped from its baked version when it
+        is up to date and baked with the same option, else parsed by pyassimp """
+    path = baked_path(file)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(file):
+        with startup.phase('map', file=path):
+            scene = read_scene(path)
+        if scene is not None and scene.option == option:
+            return scene
+    with startup.phase('parse', file=file):
+        return parse_scene(file, option)
+
+
+def load_channels(file, option=0):
+    """ first animation channels of a model file, from its baked version when
+        up to date whatever option it was baked with, since the mesh
+        post-processing leaves the nodes and their keys alone; else parsed
+        with option, none by default """
+    path = baked_path(file)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(file):
+        with startup.phase('map', file=path):
+            scene = read_scene(path)
+        if scene is not None:
+            return scene.channels
+    with startup.phase('parse', file=file):
+        return parse_channels(file, option)
+
+
+def bake(file, option):
+    """ parse a model file and write its baked version """
+    scene = parse_scene(file, option)
+    if scene is not None:
+        write_scene(baked_path(file), scene)
+        print('Baked %s\t(%d meshes, %d nodes, %d channels)' %
+              (baked_path(file), len(scene.meshes), len(scene.nodes), len(scene.channels)))
+
+
+def main():
+    """ bake the files given on the command line, or the whole scene """
+    patterns = sys.argv[1:] or DEFAULT_FILES
+    for file in sorted(set(f for pattern in patterns for f in glob.glob(pattern))):
+        if not file.endswith('.bake'):
+            bake(file, POSTPROCESS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Micro benchmarks of the scene building blocks.
+Usage: python3 benchmark.py <name> [arguments], names are listed by
+python3 benchmark.py without argument.
+"""
+import os
+import sys
+import time
+import glob
+import tracemalloc
+
+import numpy as np
+
+from terrain import build_terrain, HeightField, chunk_indices, chunk_lods, edge_steps
+
+
+def timed(function, *args, repeat=3):
+    """ best wall clock time in seconds of function(*args) over repeat runs """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_terrain(*sizes):
+    """ Ground mesh build time against the height map size """
+    sizes = [int(size) for size in sizes] or [64, 128, 256, 512, 1024]
+    print('%8s %10s %10s %12s' % ('size', 'vertices', 'faces', 'build (ms)'))
+    for size in sizes:
+        pixels = np.random.randint(0, 256, (size, size))
+        seconds = timed(build_terrain, pixels, (-100, -120, -100), 3, 0.8)
+        print('%8d %10d %10d %12.2f' % (size, size*size, 2*(size-1)**2, seconds*1e3))
+
+
+def bench_heightfield(*counts):
+    """ batched height field queries against the number of agents """
+    counts = [int(count) for count in counts] or [1, 100, 1000, 10000]
+    field = HeightField(np.random.uniform(0, 200, (256, 256)), (-100, -120, -100), 3, 0.8)
+    print('%8s %14s %14s %14s' % ('agents', 'heights (us)', 'slopes (us)', 'normals (us)'))
+    for count in counts:
+        xs, zs = np.random.uniform(-100, 155, (2, count))
+        print('%8d %14.1f %14.1f %14.1f' % (
+            count, timed(field.get_heights, xs, zs)*1e6,
+            timed(field.get_slopes, xs, zs, xs + 1, zs)*1e6,
+            timed(field.get_normals, xs, zs)*1e6))
+
+
+def bench_lod(size=1024, chunkSize=32, lods=4, lodDistance=150):
+    """ triangles drawn by the chunked ground against the camera height """
+    size, chunkSize, lods, lodDistance = int(size), int(chunkSize), int(lods), float(lodDistance)
+    chunks = -(-(size - 1) // chunkSize)
+    cz, cx = np.mgrid[0:chunks, 0:chunks]
+    centers = (np.stack((cx, cz), axis=-1) + 0.5 - chunks/2) * chunkSize * 3
+    patterns = {}
+    print('map %dx%d, %d chunks, full resolution %d triangles' % (size, size, chunks**2, 2*(size-1)**2))
+    print('%10s %12s %14s' % ('height', 'triangles', 'lod histogram'))
+    for height in (10, 50, 150, 400, 1000, 3000):
+        distances = np.sqrt((centers**2).sum(axis=-1) + height**2)
+        levels = chunk_lods(distances, lodDistance, lods)
+        triangles = 0
+        for lod, edges in zip(levels.ravel(), edge_steps(levels).reshape(-1, 4)):
+            key = (lod, tuple(edges))
+            if key not in patterns:
+                patterns[key] = len(chunk_indices(chunkSize, 2**lod, edges))
+            triangles += patterns[key]
+        print('%10d %12d %14s' % (height, triangles, np.bincount(levels.ravel(), minlength=lods)))
+
+
+def legacy_bone_weights(bones, vertex_count, max_bones=128, size=4):
+    """ per vertex bone packing as previously done by the skinned loaders """
+    v_bone = np.array([[(0, 0)]*max_bones] * vertex_count,
+                      dtype=[('weight', 'f4'), ('id', 'u4')])
+    for bone_id, bone in enumerate(bones[:max_bones]):
+        for entry in bone.weights:
+            v_bone[entry.vertexid][bone_id] = (entry.weight, bone_id)
+    v_bone.sort(order='weight')
+    v_bone = v_bone[:, -size:]
+    return v_bone['id'], v_bone['weight']
+
+
+def peak_memory(function, *args):
+    """ peak python memory in bytes allocated during function(*args) """
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_skinning(*files):
+    """ bone weight packing time and peak memory on the dino files """
+    import pyassimp
+    from loader import POSTPROCESS
+    from skinning import MAX_BONES, bone_entries, pack_bone_weights
+
+    def packed(mesh):
+        return pack_bone_weights(*bone_entries(mesh.bones[:MAX_BONES]), mesh.vertices.shape[0])
+
+    def legacy(mesh):
+        return legacy_bone_weights(mesh.bones, mesh.vertices.shape[0])
+
+    print('%-28s %10s %12s %12s %12s %12s' % ('file', 'parse (ms)', 'legacy (ms)',
+                                            'legacy (MB)', 'packed (ms)', 'packed (MB)'))
+    for file in files or sorted(glob.glob('dino/*.dae')):
+        start = time.perf_counter()
+        scene = pyassimp.load(file, POSTPROCESS)
+        parse = time.perf_counter() - start
+        meshes = [mesh for mesh in scene.meshes if mesh.bones]
+        results = [parse]
+        for pack in (legacy, packed):
+            results.append(sum(timed(pack, mesh, repeat=1) for mesh in meshes))
+            results.append(max((peak_memory(pack, mesh) for mesh in meshes), default=0) / 2**20)
+        print('%-28s %10.1f %12.1f %12.2f %12.1f %12.2f' % (
+            file, results[0]*1e3, results[1]*1e3, results[2], results[3]*1e3, results[4]))
+        pyassimp.release(scene)
+
+
+def bench_bake(*files):
+    """ scene load time parsed by pyassimp against memory mapped baked files """
+    import tempfile
+    from bake import POSTPROCESS, DEFAULT_FILES, parse_scene, write_scene, read_scene
+
+    def touch(scene):
+        return sum(float(mesh.vertices[-1, 0]) for mesh in scene.meshes)
+
+    print('%-28s %10s %10s %12s %12s' % ('file', 'size (MB)', 'baked (MB)',
+                                         'parse (ms)', 'mapped (ms)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for file in files or sorted(f for pattern in DEFAULT_FILES for f in glob.glob(pattern)):
+            path = os.path.join(directory, os.path.basename(file) + '.bake')
+            parse = timed(lambda: touch(parse_scene(file, POSTPROCESS)), repeat=1)
+            write_scene(path, parse_scene(file, POSTPROCESS))
+            mapped = timed(lambda: touch(read_scene(path)))
+            print('%-28s %10.2f %10.2f %12.1f %12.2f' % (
+                file, os.path.getsize(file) / 2**20, os.path.getsize(path) / 2**20,
+                parse*1e3, mapped*1e3))
+
+
+def bench_clips(*files):
+    """ clip import time and memory against a full model load (dino/*.dae):
+        clips are parsed without mesh post-processing, their node names
+        checked against the skeleton of the post-processed model """
+    from bake import POSTPROCESS, parse_scene, parse_channels
+
+    def mesh_bytes(scene):
+        return sum(array.nbytes for mesh in scene.meshes for array in
+                   (mesh.vertices, mesh.normals, mesh.faces, mesh.texcoords, mesh.bone_entries)
+                   if array is not None)
+
+    def clip_bytes(channels):
+        return sum(times.nbytes + values.nbytes for trs in channels.values()
+                   for times, values in trs)
+
+    print('%-28s %9s %10s %10s %10s %10s %8s' % ('file', 'channels', 'mesh (MB)', 'clip (MB)',
+                                                 'model (ms)', 'clip (ms)', 'missing'))
+    model_total = clip_total = 0
+    for file in files or sorted(glob.glob('dino/*.dae')):
+        scene = parse_scene(file, POSTPROCESS)
+        channels = parse_channels(file)
+        model = timed(lambda: parse_scene(file, POSTPROCESS), repeat=1)
+        clip = timed(lambda: parse_channels(file), repeat=1)
+        missing = set(channels) - {node.name for node in scene.nodes}
+        model_total, clip_total = model_total + model, clip_total + clip
+        print('%-28s %9d %10.2f %10.3f %10.1f %10.1f %8d' % (
+            file, len(channels), mesh_bytes(scene) / 2**20, clip_bytes(channels) / 2**20,
+            model * 1e3, clip * 1e3, len(missing)))
+    print('%-28s %9s %10s %10s %10.1f %10.1f' % ('total', '', '', '', model_total * 1e3,
+                                                clip_total * 1e3))
+
+
+def random_skeleton(count=64, keys=30, duration=1.0):
+    """ parents, rest transforms and channels of a random animated skeleton """
+    rng = np.random.default_rng(0)
+    parents = [-1] + [int(rng.integers(0, node)) for node in range(1, count)]
+    rest = np.broadcast_to(np.identity(4, np.float32), (count, 4, 4))
+    times = np.linspace(0, duration, keys)
+    channels = {node: ((times, rng.normal(size=(keys, 3))),
+                       (times, rng.normal(size=(keys, 4))),
+                       (times, rng.uniform(0.5, 1.5, (keys, 3))))
+                for node in range(1, count)}
+    return parents, rest, channels
+
+
+def bench_pose(file=None):
+    """ per node keyframes against the vectorized pose evaluator, in us per pose """
+    from node import TransformKeyFrames
+    from pose import SkeletonPose
+    if file:
+        from bake import POSTPROCESS, load_scene
+        scene = load_scene(file, POSTPROCESS)
+        parents = [node.parent for node in scene.nodes]
+        rest = [node.transform for node in scene.nodes]
+        channels = {index: scene.channels[node.name] for index, node in enumerate(scene.nodes)
+                    if node.name in scene.channels}
+    else:
+        parents, rest, channels = random_skeleton()
+    keyframes = {node: TransformKeyFrames(*(dict(zip(times.tolist(), values)) for times, values in trs))
+                 for node, trs in channels.items()}
+    pose = SkeletonPose(parents, rest, channels)
+    times = np.random.uniform(0, 1, 100)
+
+    def node_path():
+        """ SkinningControlNode.draw: keys of each node, then its parent world """
+        for time in times:
+            worlds = []
+            for node, parent in enumerate(parents):
+                local = keyframes[node].value(time) if node in keyframes else rest[node]
+                worlds.append(local if parent < 0 else worlds[parent] @ local)
+
+    def vectorized():
+        for time in times:
+            pose.world(time)
+
+    print('%d nodes, %d animated, %d levels' % (len(parents), len(channels), len(pose.levels)))
+    print('%-22s %12s' % ('evaluator', 'us / pose'))
+    print('%-22s %12.1f' % ('node path', timed(node_path) / times.size * 1e6))
+    print('%-22s %12.1f' % ('vectorized', timed(vectorized) / times.size * 1e6))
+    print('%-22s %12.1f' % ('vectorized, batched', timed(pose.world, times) / times.size * 1e6))
+
+
+class NullDrawable:
+    """ leaf drawable doing nothing, to time the scene graph traversal alone """
+    def draw(self, projection, view, model, **param):
+        pass
+
+
+def bench_nodes(depth=4, width=4):
+    """ static scene graph draw with cached world transforms against recomputing them """
+    from node import Node
+    depth, width = int(depth), int(width)
+
+    def tree(level):
+        children = [tree(level + 1) for _ in range(width)] if level < depth else [NullDrawable()]
+        return Node(children=children, transform=np.identity(4, np.float32))
+    root, nodes = tree(0), (width**(depth + 1) - 1) // (width - 1)
+    identity = np.identity(4, np.float32)
+
+    def invalidate(node):
+        node.transform = node.transform
+        for child in node.children:
+            if isinstance(child, Node):
+                invalidate(child)
+
+    def cached():
+        root.draw(None, None, identity)
+
+    def dirty():
+        invalidate(root)
+        root.draw(None, None, identity)
+
+    updates = Node.updates
+    cached()
+    print('%d nodes, %d world transforms computed on first draw' % (nodes, Node.updates - updates))
+    print('%-22s %12s %10s' % ('traversal', 'us / frame', 'updates'))
+    for name, draw in (('all dirty', dirty), ('static, cached', cached)):
+        seconds = timed(draw, repeat=20)
+        updates = Node.updates
+        draw()
+        print('%-22s %12.1f %10d' % (name, seconds * 1e6, Node.updates - updates))
+
+
+def bench_flat(*counts):
+    """ recursive node traversal against the flattened scene, moving every node """
+    from node import Node
+    from flat_scene import FlatScene
+    counts = [int(count) for count in counts] or [1000, 10000, 50000]
+    identity = np.identity(4, np.float32)
+    rng = np.random.default_rng(0)
+    print('%8s %8s %16s %16s' % ('nodes', 'levels', 'recursive (ms)', 'flattened (ms)'))
+    for count in counts:
+        nodes = [Node(transform=identity)]
+        for parent in rng.integers(0, np.arange(1, count)):
+            nodes.append(Node(transform=identity))
+            nodes[parent].add(nodes[-1])
+        scene = FlatScene(nodes[0])
+        transforms = rng.normal(size=(count, 4, 4)).astype(np.float32)
+
+        def recursive():
+            for node, transform in zip(nodes, transforms):
+                node.transform = transform
+            nodes[0].draw(None, None, identity)
+
+        def flattened():
+            scene.locals[:] = transforms
+            scene._model = None
+            scene.update(identity)
+
+        print('%8d %8d %16.1f %16.1f' % (count, len(scene.levels),
+                                          timed(recursive) * 1e3, timed(flattened) * 1e3))
+
+
+def bench_decode(*workers):
+    """ decode wall time of the scene images against the number of worker threads """
+    from concurrent.futures import ThreadPoolExecutor
+    from texture import decode_image
+
+    files = [file for pattern in ('skybox2.jpg', 'ground/*', 'control/*.png', 'dino/textures/[!.]*')
+             for file in sorted(glob.glob(pattern))]
+    pixels = sum(decode_image(file).size for file in files)
+    print('%d images, %.1f MB decoded' % (len(files), pixels / 2**20))
+    print('%8s %12s %10s' % ('workers', 'wall (ms)', 'speedup'))
+    sequential = timed(lambda: [decode_image(file) for file in files])
+    print('%8s %12.1f %10.2f' % ('serial', sequential * 1e3, 1))
+    for count in [int(count) for count in workers] or [1, 2, 4, os.cpu_count() or 1]:
+        with ThreadPoolExecutor(count) as pool:
+            seconds = timed(lambda: list(pool.map(decode_image, files)))
+        print('%8d %12.1f %10.2f' % (count, seconds * 1e3, sequential / seconds))
+
+
+def bench_scene(frames=300, output='scene_bench.json', baseline=None, tolerance=0.1):
+    """ main scene rendered headless on a fixed clock and camera path, JSON report """
+    import json
+    import glfw
+    import OpenGL.GL as GL
+    from transform import quaternion_from_euler
+    from viewer import Viewer
+    from main import build_scene
+    from render import state
+    frames, tolerance, step, warmup = int(frames), float(tolerance), 1 / 60, 10
+
+    glfw.init()
+    np.random.seed(0)                       # same forest every run
+    viewer = Viewer(visible=False)
+    dino = build_scene(viewer)
+    trackball = viewer.trackball
+
+    times, draws, triangles = [], [], []
+    for index in range(-warmup, frames):
+        # camera orbiting the dino twice, zooming out then back in
+        progress = max(index, 0) / frames
+        trackball.rotation = quaternion_from_euler(720 * progress, 0, 20)
+        trackball.distance = 3 + 300 * np.sin(np.pi * progress)
+        glfw.set_time((index + warmup) * step)  # simulated clock, one step per frame
+        start = time.perf_counter()
+        viewer.frame(dino)
+        GL.glFinish()                       # include the GPU work of the frame
+        if index >= 0:
+            times.append((time.perf_counter() - start) * 1e3)
+            draws.append(viewer.draws)
+            triangles.append(viewer.triangles)
+    glfw.terminate()
+
+    times = np.array(times)
+    report = dict(frames=frames, step=step,
+                  frame_ms=dict(mean=times.mean(), p50=np.percentile(times, 50),
+                                p95=np.percentile(times, 95), p99=np.percentile(times, 99)),
+                  draws=float(np.mean(draws)), triangles=float(np.mean(triangles)))
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('%d frames, draws %.1f, triangles %.0f per frame' % (frames, report['draws'], report['triangles']))
+    print(' '.join('%s %.2f ms' % item for item in report['frame_ms'].items()))
+    print('Saved %s' % output)
+    if baseline is None:
+        return
+
+    # flag frame times and draw calls above the baseline beyond the tolerance
+    with open(baseline) as file:
+        reference = json.load(file)
+    metrics = [('frame_ms ' + name, report['frame_ms'][name], reference['frame_ms'][name])
+               for name in report['frame_ms']] + [('draws', report['draws'], reference['draws'])]
+    regressions = 0
+    print('%-16s %12s %12s %8s' % ('metric', 'baseline', 'current', 'change'))
+    for name, current, previous in metrics:
+        change = current / previous - 1 if previous else 0
+        flag = change > tolerance
+        regressions += flag
+        print('%-16s %12.2f %12.2f %+7.1f%% %s' % (name, previous, current, change * 100,
+                                                   'REGRESSION' if flag else ''))
+    if regressions:
+        sys.exit('%d metrics regressed by more than %d%%' % (regressions, tolerance * 100))
+
+
+BENCHMARKS = {'terrain': bench_terrain,
+              'heightfield': bench_heightfield,
+              'lod': bench_lod,
+              'skinning': bench_skinning,
+              'bake': bench_bake,
+              'clips': bench_clips,
+              'pose': bench_pose,
+              'nodes': bench_nodes,
+              'flat': bench_flat,
+              'decode': bench_decode,
+              'scene': bench_scene}
+
+
+def main():
+    """ run the benchmark named on the command line """
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        for name, bench in sorted(BENCHMARKS.items()):
+            print('%-12s %s' % (name, bench.__doc__.strip()))
+        return
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Process wide memoization of loaded assets, shared between their users.
+Entries are keyed by loader, path, post-process flags and file mtime, they
+are reference counted and the least recently used unreferenced ones are
+evicted when the GPU memory they hold exceeds the budget.
+"""
+import os
+import inspect
+import functools
+from collections import OrderedDict
+
+from startup import startup
+
+
+def gpu_bytes(asset, seen=None):
+    """ GPU memory in bytes held by vertex arrays and textures of an asset,
+        objects whose id is in seen left out """
+    seen = set() if seen is None else seen
+    if id(asset) in seen:
+        return 0
+    seen.add(id(asset))
+    if isinstance(asset, (list, tuple)):
+        return sum(gpu_bytes(item, seen) for item in asset)
+    size = getattr(asset, 'nbytes', 0)
+    for name in ('vertex_array', 'texture', 'children'):
+        if hasattr(asset, name):
+            size += gpu_bytes(getattr(asset, name), seen)
+    return size
+
+
+class AssetCache:
+    """ LRU cache of loaded assets under a GPU memory budget """
+
+    def __init__(self, budget=512 << 20):
+        self.budget = budget        # bytes of GPU memory, None for no limit
+        self.entries = OrderedDict()  # key -> [asset, references, bytes, dependencies]
+        self.loading = []           # dependencies of the loads in progress
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def bytes(self):
+        """ GPU memory held by all cached assets """
+        return sum(entry[2] for entry in self.entries.values())
+
+    def get(self, key, load):
+        """ cached asset for key, calling load() on a miss; takes a reference """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            # assets got while loading are held by this one, released with it
+            self.loading.append([])
+            try:
+                asset = load()
+            finally:
+                dependencies = self.loading.pop()
+            if not asset:       # failed loads are retried next time
+                for dependency in dependencies:
+                    self.release(dependency)
+                return asset
+            # dependencies are entries of their own, sized there and not again here
+            size = gpu_bytes(asset, {id(dependency) for dependency in dependencies})
+            entry = self.entries[key] = [asset, 0, size, dependencies]
+        entry[1] += 1
+        if self.loading:
+            self.loading[-1].append(entry[0])
+        self.evict()
+        return entry[0]
+
+    def release(self, asset):
+        """ drop a reference on a cached asset, making it evictable at zero """
+        self.unreference(asset)
+        self.evict()
+
+    def unreference(self, asset):
+        """ drop a reference on a cached asset, without evicting """
+        for entry in self.entries.values():
+            if entry[0] is asset:
+                entry[1] = max(entry[1] - 1, 0)
+                return
+
+    def evict(self):
+        """ evict unreferenced assets, oldest first, until within budget; the
+            assets an evicted one held become evictable in turn """
+        if self.budget is None:
+            return
+        total = self.bytes
+        while total > self.budget:
+            key = next((key for key, entry in self.entries.items() if not entry[1]), None)
+            if key is None:
+                break
+            _, _, size, dependencies = self.entries.pop(key)
+            total -= size
+            self.evictions += 1
+            for dependency in dependencies:
+                self.unreference(dependency)
+
+    def clear(self):
+        """ forget every cached asset """
+        self.entries.clear()
+
+    def stats(self):
+        """ dictionary of cache statistics """
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, bytes=self.bytes, budget=self.budget)
+
+
+# process wide cache used by the loaders
+assets = AssetCache()
+
+
+def cached_loader(loader):
+    """ decorator sharing the results of loader(file, ...) through assets,
+        keyed by all the loader arguments, defaults included """
+    signature = inspect.signature(loader)
+
+    @functools.wraps(loader)
+    def load(file, *args, **kwargs):
+        arguments = signature.bind(file, *args, **kwargs)
+        arguments.apply_defaults()
+        path = os.path.abspath(file)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        key = (loader.__module__, loader.__name__, path,
+               tuple(arguments.arguments.items())[1:], mtime)
+        def load_timed():
+            with startup.phase(loader.__name__, file=file):
+                return loader(file, *args, **kwargs)
+        return assets.get(key, load_timed)
+    return load
@@ -1,7 +1,7 @@
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 from texture import TexturedMesh
-from texture import Texture
+from texture import Texture, TextureArray
 from PIL import Image
 import numpy as np
 from math import floor
@@ -9,6 +9,7 @@ import operator
 from mesh import VertexArray
 from transform import *
 from shader import Shader
+from render import state, PASS_OVERLAY
 from itertools import cycle
 
 
@@ -23,15 +24,17 @@ void main() {
 }"""
 
 TEXTURE_FRAG = """#version 330 core
-uniform sampler2D diffuseMap;
+uniform sampler2DArray diffuseMap;
+uniform int layer;
 in vec2 fragTexCoord;
 out vec4 outColor;
 void main() {
-    outColor = texture(diffuseMap, fragTexCoord);
+    outColor = texture(diffuseMap, vec3(fragTexCoord, layer));
 }"""
 
 
 class Control:
+    render_pass = PASS_OVERLAY  # heads up display, drawn over the scene
 
     def __init__(self):
         # feel free to move this up in the viewer as per other practicals
@@ -50,82 +53,35 @@ class Control:
                              (GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR)])
         self.wrap_mode, self.filter_mode = next(self.wrap), next(self.filter)
 
-        # setup texture and upload it to GPU
-        self.textures = {"CLEAR": Texture("control/arrows.png", self.wrap_mode, *self.filter_mode),
-                         "UP" : Texture("control/arrowsUP.png", self.wrap_mode, *self.filter_mode),
-                         "LEFT" : Texture("control/arrowsRIGHT.png", self.wrap_mode, *self.filter_mode),
-                         "RIGHT" : Texture("control/arrowsLEFT.png", self.wrap_mode, *self.filter_mode)
-                            }
-        self.texture = self.textures["CLEAR"]
+        # setup the arrow images in the layers of one texture, upload it to GPU
+        self.texture = TextureArray(["control/arrows.png", "control/arrowsUP.png",
+                                     "control/arrowsRIGHT.png", "control/arrowsLEFT.png"],
+                                    self.wrap_mode, *self.filter_mode)
+        self.layers = {"CLEAR": 0, "UP": 1, "LEFT": 2, "RIGHT": 3}
+        self.layer = self.layers["CLEAR"]
 
     def draw(self, projection, view, model, win=None, **_kwargs):
 
-        GL.glUseProgram(self.shader.glid)
+        state.use_program(self.shader.glid)
 
         # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        self.shader.set_mat4('modelviewprojection', projection @ view @ model)
 
         # texture access setups
-        loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
+        self.shader.set_int('diffuseMap', 0)
+        self.shader.set_int('layer', self.layer)
+        state.bind_texture(self.texture.glid, 0, self.texture.target)
         self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
-
     def on_key(self, _win, key, _scancode, action, _mods):
         """ 'Q' or 'Escape' quits """
 
         if action == glfw.PRESS or action == glfw.REPEAT:
             if key == glfw.KEY_UP:
-                self.texture = self.textures["UP"]
+                self.layer = self.layers["UP"]
             if key == glfw.KEY_LEFT:
-                self.texture = self.textures["LEFT"]
+                self.layer = self.layers["LEFT"]
             if key == glfw.KEY_RIGHT:
-                self.texture = self.textures["RIGHT"]
+                self.layer = self.layers["RIGHT"]
         else :
-            self.texture = self.textures["CLEAR"]
-
-def load_textured(file):
-    """ load resources using pyassimp, return list of TexturedMeshes """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
-        return []  # error reading => return empty list
-
-    # Note: embedded textures not supported at the moment
-    path = os.path.dirname(file)
-    for mat in scene.materials:
-        mat.tokens = dict(reversed(list(mat.properties.items())))
-        if 'file' in mat.tokens:  # texture file token
-            tname = mat.tokens['file'].split('/')[-1].split('\\')[-1]
-            # search texture in file's whole subdir since path often screwed up
-            tname = [os.path.join(d[0], f) for d in os.walk(path) for f in d[2]
-                     if tname.startswith(f) or f.startswith(tname)]
-            if tname:
-                mat.texture = Texture(tname[0])
-            else:
-                print('Failed to find texture:', tname)
-
-    # prepare textured mesh
-    meshes = []
-    for mesh in scene.meshes:
-        texture = scene.materials[mesh.materialindex].texture
-
-        # tex coords in raster order: compute 1 - y to follow OpenGL convention
-        tex_uv = ((0, 1) + mesh.texturecoords[0][:, :2] * (1, -1)
-                  if mesh.texturecoords.size else None)
-
-        # create the textured mesh object from texture, attributes, and indices
-        meshes.append(TexturedMesh(texture, [mesh.vertices, tex_uv], index=mesh.faces))
-
-    size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
-
-    pyassimp.release(scene)
-    return meshes
+            self.layer = self.layers["CLEAR"]
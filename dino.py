@@ -1,9 +1,29 @@
 from texture_skin import *
+from skinning import ClipLibrary
+from texture_anim import BakedClipPlayer
+import glob
+from cache import assets
+from flat_scene import FlatScene
+
+CLIP_KEYS = [glfw.KEY_1, glfw.KEY_2, glfw.KEY_3, glfw.KEY_4,
+             glfw.KEY_5, glfw.KEY_6, glfw.KEY_7, glfw.KEY_8]
 
 class Dino:
     """ Place node with transform keys above a controlled subtree """
-    def __init__(self, ground, *keys, **kwargs):
-        self.mesh = load_textured_skinned("dino/Dinosaurus_walk.dae")[0]
+    culls = True    # meshes culled and counted by its flattened scene
+
+    def __init__(self, ground, *keys, baked=False, **kwargs):
+        self.meshes = load_textured_skinned("dino/Dinosaurus_walk.dae", priority=PRIORITY_HIGH)
+        self.mesh = self.meshes[0]
+        # every clip animates the skeleton of the walk model
+        self.clips = ClipLibrary(self.mesh, sorted(glob.glob("dino/*.dae")))
+        self.clips.play("walk")
+        # baked: clips played from animation textures, skeleton not evaluated
+        self.player = BakedClipPlayer(self.clips) if baked else self.clips
+        if baked:
+            self.mesh = self.player
+        # skeleton posed in arrays, one batched product per hierarchy level
+        self.scene = FlatScene(self.mesh)
         self.xyz = np.array([0,ground.getHeight(0, 0),0])
         self.direction = 0
         self.slope = 0
@@ -11,8 +31,11 @@ class Dino:
         self.ground = ground
 
     def draw(self, projection, view, model, **param):
-        """ When redraw requested, interpolate our node transform from keys """
-        self.mesh.draw(projection, view, model @ self.model, **param)
+        """ When redraw requested, interpolate the skeleton transforms from keys """
+        self.scene.draw(projection, view, model @ self.model, **param)
+
+    def __del__(self):  # give the shared model back to the asset cache
+        assets.release(self.meshes)
 
     def move(self,key):
         angle = [0, 270, 180, 90][self.direction]
@@ -27,9 +50,11 @@ class Dino:
 
         start = vec(self.xyz)
         self.xyz += direction*3
-        self.xyz[1] = self.ground.getHeight(self.xyz[0]/3, self.xyz[2]/3)
+        heightField, widthScale = self.ground.heightField, self.ground.widthScale
+        self.xyz[1] = heightField.get_heights(self.xyz[0]/widthScale, self.xyz[2]/widthScale)
 
-        self.slope = self.ground.getSlope(start[0]/3, start[2]/3, self.xyz[0]/3, self.xyz[2]/3)
+        self.slope = heightField.get_slopes(start[0]/widthScale, start[2]/widthScale,
+                                            self.xyz[0]/widthScale, self.xyz[2]/widthScale)
 
         if key == glfw.KEY_LEFT:
             rotate_keys = {0: quaternion_from_euler(0, angle, old_slope), 1: quaternion_from_euler(0, angle + 90, self.slope)}
@@ -48,4 +73,6 @@ class Dino:
     def on_key(self, _win, key, _scancode, action, _mods):
         if (action == glfw.PRESS or action == glfw.REPEAT) and (glfw.get_time() - self.mesh.time >= 1):
             if key == glfw.KEY_LEFT or key == glfw.KEY_RIGHT or key == glfw.KEY_UP:
-                self.move(key)
\ No newline at end of file
+                self.move(key)
+        if action == glfw.PRESS and key in CLIP_KEYS[:len(self.clips.order)]:
+            self.player.play(self.clips.order[CLIP_KEYS.index(key)])
@@ -0,0 +1,110 @@
+"""
+Flattened scene graph: a Node hierarchy compiled into contiguous arrays of
+parent indices, local and world transforms, propagated with one batched
+matrix product per hierarchy level instead of a recursive traversal.
+"""
+import numpy as np
+
+from node import Node
+from pose import hierarchy_levels, propagate
+
+
+class FlatScene:
+    """
+    Drawable compiled from a Node hierarchy. Nodes are indexed in depth
+    first order, the drawables of the hierarchy (its non Node children)
+    being drawn with the world matrix of their parent node. Animated nodes
+    are re-read every frame; the transform of other nodes is set through
+    set_transform, or by compiling again after structural changes.
+    """
+    culls = True    # leaves culled and counted one by one
+
+    def __init__(self, root):
+        self.root = root
+        self.compile()
+
+    def compile(self):
+        """ flatten the hierarchy below the root into arrays """
+        self.nodes, parents = [], []
+        leaves = []         # (drawable, node index, merged parameters)
+        stack = [(self.root, -1, {})]
+        while stack:
+            node, parent, param = stack.pop()
+            index = len(self.nodes)
+            param = dict(param, **node.param)
+            self.nodes.append(node)
+            parents.append(parent)
+            for child in reversed(node.children):
+                if isinstance(child, Node):
+                    stack.append((child, index, param))
+                else:
+                    leaves.append((child, index, param))
+
+        self.index = {id(node): index for index, node in enumerate(self.nodes)}
+        self.parents = np.array(parents, np.intp)
+        self.levels = hierarchy_levels(self.parents)
+        self.locals = np.array([node.transform for node in self.nodes], np.float32).reshape(-1, 4, 4)
+        self.worlds = np.empty_like(self.locals)
+        self.animated = np.array([index for index, node in enumerate(self.nodes)
+                                  if node.animated], np.intp)
+        # skeleton nodes whose world transform skinned meshes read
+        self.bones = [index for index, node in enumerate(self.nodes)
+                      if hasattr(node, 'world_transform')]
+        self.leaves = leaves
+        self._model = None
+
+        # leaf bounds in their node frame, unbounded leaves always drawn
+        bounded = [(position, leaf[0].bounds) for position, leaf in enumerate(leaves)
+                   if getattr(leaf[0], 'bounds', None) is not None]
+        self.bounded = np.array([position for position, _ in bounded], np.intp)
+        self.bounded_nodes = np.array([leaves[position][1] for position, _ in bounded], np.intp)
+        self.centers = np.array([np.append(sphere[0], 1) for _, sphere in bounded],
+                                np.float32).reshape(-1, 4)
+        self.radii = np.array([sphere[1] for _, sphere in bounded], np.float32)
+
+    def set_transform(self, node, transform):
+        """ change the local transform of a node of the compiled hierarchy """
+        node.transform = transform
+        self.locals[self.index[id(node)]] = transform
+        self._model = None
+
+    def update(self, model, win=None):
+        """ world transforms of every node, recomputed only if something moved """
+        for index in self.animated:
+            self.nodes[index].animate(win)
+        if self.animated.size:
+            self.locals[self.animated] = [self.nodes[index].transform for index in self.animated]
+        elif self._model is not None and np.array_equal(model, self._model):
+            return self.worlds
+        self._model = model
+        np.copyto(self.worlds, self.locals)
+        propagate(self.worlds, self.parents, self.levels, np.asarray(model, np.float32))
+        for index in self.bones:
+            self.nodes[index].world_transform = self.worlds[index]
+        return self.worlds
+
+    def draw(self, projection, view, model, win=None, frustum=None, queue=None, **param):
+        """ draw every leaf with the world matrix of its node, or add them
+            to the render queue if given """
+        worlds = self.update(model, win)
+        visible = np.ones(len(self.leaves), bool)
+        if frustum is not None and self.bounded.size:
+            matrices = worlds[self.bounded_nodes]
+            centers = np.einsum('nij,nj->ni', matrices[:, :3], self.centers)
+            radii = self.radii * np.linalg.norm(matrices[:, :3, :3], axis=1).max(axis=1)
+            visible[self.bounded] = frustum.visible_spheres(centers, radii)
+        if frustum is not None:     # unbounded leaves, always drawn
+            frustum.drawn += len(self.leaves) - self.bounded.size
+        for (drawable, index, leaf_param), shown in zip(self.leaves, visible):
+            if not shown:
+                continue
+            leaf_param = dict(param, **leaf_param) if param else leaf_param
+            if queue is not None:
+                queue.add(drawable, projection, view, worlds[index], frustum=frustum, **leaf_param)
+            else:
+                drawable.draw(projection, view, worlds[index], frustum=frustum, **leaf_param)
+
+    @property
+    def bounds(self):
+        """ flattened scenes are tested leaf by leaf """
+        return None
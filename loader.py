@@ -1,42 +1,36 @@
-import pyassimp                     # 3D ressource loader
-import pyassimp.errors              # assimp error management + exceptions
 from mesh import *
+from cache import cached_loader
+from bake import POSTPROCESS, load_scene
 import os
 
 # -------------- 3D ressource loader -----------------------------------------
-def load(file):
-    """ load resources from file using pyassimp, return list of ColorMesh """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+# scenes come from their baked file when up to date, else from pyassimp
+@cached_loader
+def load(file, option=POSTPROCESS):
+    """ load resources from file, return list of VertexArray """
+    scene = load_scene(file, option)
+    if scene is None:
         return []     # error reading => return empty list
 
     meshes = [VertexArray([m.vertices, m.normals], m.faces) for m in scene.meshes]
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
-
-    pyassimp.release(scene)
     return meshes
 
-def loadColorMesh(file):
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+@cached_loader
+def loadColorMesh(file, option=POSTPROCESS):
+    """ load resources from file, return list of ColorMesh """
+    scene = load_scene(file, option)
+    if scene is None:
         return []  # error reading => return empty list
 
     meshes = []
     for mesh in scene.meshes:
-        color = scene.materials[mesh.materialindex].properties["diffuse"]
+        color = scene.materials[mesh.material]["diffuse"]
 
         # create the textured mesh object from texture, attributes, and indices
         meshes.append(ColorMesh([mesh.vertices, mesh.normals], color, index=mesh.faces))
 
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
-
-    pyassimp.release(scene)
     return meshes
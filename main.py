@@ -4,40 +4,82 @@ import OpenGL.GL as GL
 import glfw
 from viewer import Viewer
 from skybox import Skybox
+import texture
 from texture import *
 from skinning import *
 from texture_skin import *
 from Ground import Ground
 from control import Control
 from dino import Dino
-from tree import Tree
+from tree import Forest
+from shader import Shader
+from profiler import profiler
+from startup import startup
+from cache import assets
 import numpy as np
+import sys
+import glob
 
-def main():
-    """ Run the rendering loop for the scene. """
-    viewer = Viewer()
+# images of the scene, decoded on worker threads while the rest loads
+SCENE_IMAGES = ["skybox2.jpg", "ground/ground.jpg", "ground/normal.jpg",
+                "ground/heightMap.png", "control/arrows.png", "control/arrowsUP.png",
+                "control/arrowsLEFT.png", "control/arrowsRIGHT.png"] + \
+               sorted(glob.glob("dino/textures/[!.]*"))
 
+def build_scene(viewer, baked=False):
+    """ Add the ground, forest, controls and dino to the viewer, return the dino. """
     origin = (-100,-120, -100)
     widthScale = 3
 
-    ground = Ground(origin, widthScale, 0.8)
+    with startup.phase('ground'):
+        ground = Ground(origin, widthScale, 0.8)
     viewer.add(ground)
 
     #Generate trees according to a uniform law for appearance
-    trees = []
-    for x, z in ground.iterPos():
-        if(not(x%10) and not(z%10)): #generating
-            if(np.random.uniform() > 0.75):
-                tree = Tree(x*widthScale, ground.getHeight(x, z)+2, z*widthScale)
-                trees.append(tree)
-                viewer.add(tree.node)
+    with startup.phase('forest'):
+        xs, zs = ground.heightField.positions()
+        grid = (xs % 10 == 0) & (zs % 10 == 0)
+        xs, zs = xs[grid], zs[grid]
+        kept = np.random.uniform(size=xs.size) > 0.75
+        xs, zs = xs[kept], zs[kept]
+        forest = Forest("tree/tree.obj")
+        forest.add(*(translate(x*widthScale, y, z*widthScale)
+                     for x, z, y in zip(xs, zs, ground.heightField.get_heights(xs, zs) + 2)))
+    viewer.add(forest)
     
 
-    control = Control()
+    with startup.phase('control'):
+        control = Control()
     viewer.add(control)
 
-    dino = Dino(ground)
+    with startup.phase('dino'):
+        dino = Dino(ground, baked=baked)
     viewer.add(dino)
+    return dino
+
+def main():
+    """ Run the rendering loop for the scene. """
+    Shader.cache_dir = "shader_cache"   # reuse linked programs across runs
+    if '--profile' in sys.argv:         # frame timings, trace written on exit
+        profiler.enabled, profiler.trace_path = True, "frame_trace.json"
+    for arg in sys.argv:
+        if arg.startswith('--texture-budget='):     # GPU memory for textures, in MB
+            memory.budget = int(arg.split('=')[1]) << 20
+        if arg.startswith('--decode-workers='):   # threads decoding the images
+            texture.DECODE_WORKERS = max(int(arg.split('=')[1]), 1)
+    startup.root.info['decode_workers'] = texture.DECODE_WORKERS
+    prefetch(*SCENE_IMAGES)
+    viewer = Viewer()
+    dino = build_scene(viewer, baked='--baked' in sys.argv)
+    drop_prefetched()
+
+    # time to first frame, phases and uploads written to startup_profile.json
+    with startup.phase('first frame'):
+        viewer.frame(dino)
+    startup.report()
+    startup.export("startup_profile.json")
+    texture_report()
+    print('Asset cache %s' % assets.stats())
 
     viewer.run(dino)
 
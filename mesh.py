@@ -2,41 +2,72 @@ import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 from shader import Shader
+from render import state
+from transform import bounding_sphere
+from startup import startup
 
 
 class VertexArray:
     def __init__(self, attributes, index=None):
         # attributes is a list of np.float32 arrays, index an optional np.uint32 array
-        self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
-        self.buffers = GL.glGenBuffers(len(attributes) + (index is not None))
-        for layout_index, buffer_data in enumerate(attributes):
-            buffer_data = np.array(buffer_data, np.float32, copy=False)
+        with startup.phase('vertex array'):
+            self.glid = GL.glGenVertexArrays(1)
+            state.bind_vertex_array(self.glid)
+            self.buffers = GL.glGenBuffers(len(attributes) + (index is not None))
+            self.nbytes = 0     # GPU memory held by the buffers
+            self.components = []    # floats per vertex of each attribute
+            for layout_index, buffer_data in enumerate(attributes):
+                buffer_data = np.array(buffer_data, np.float32, copy=False)
+                self.nbytes += buffer_data.nbytes
+                self.components.append(buffer_data.shape[1])
+                GL.glEnableVertexAttribArray(layout_index)
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[layout_index])
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, buffer_data, GL.GL_STATIC_DRAW)
+                GL.glVertexAttribPointer(layout_index, buffer_data.shape[1], GL.GL_FLOAT, False, 0, None)
+
+            # bounding sphere of the positions, used for view frustum culling
+            self.bounds = bounding_sphere(attributes[0])
+
+            self.size = self.shape = None
+            if index is not None :
+                GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
+                GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index, GL.GL_STATIC_DRAW)
+                self.size = index.size
+                self.nbytes += np.asarray(index).nbytes
+            else :
+                self.shape = attributes[0].shape[0]
+
+            # cleanup and unbind so no accidental subsequent state update
+            state.bind_vertex_array(0)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+            startup.uploaded(self.nbytes)
+
+    def share(self):
+        """ new vertex array object reading the buffers of this one, for users
+            adding attributes of their own without changing shared meshes.
+            Left bound, deleting it is up to the caller """
+        glid = GL.glGenVertexArrays(1)
+        state.bind_vertex_array(glid)
+        for layout_index, components in enumerate(self.components):
             GL.glEnableVertexAttribArray(layout_index)
             GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[layout_index])
-            GL.glBufferData(GL.GL_ARRAY_BUFFER, buffer_data, GL.GL_STATIC_DRAW)
-            GL.glVertexAttribPointer(layout_index, buffer_data.shape[1], GL.GL_FLOAT, False, 0, None)
-
-        self.size = self.shape = None
-        if index is not None :
+            GL.glVertexAttribPointer(layout_index, components, GL.GL_FLOAT, False, 0, None)
+        if self.size is not None:
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
-            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index, GL.GL_STATIC_DRAW)
-            self.size = index.size
-        else :
-            self.shape = attributes[0].shape[0]
-
-        # cleanup and unbind so no accidental subsequent state update
-        GL.glBindVertexArray(0)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        return glid
 
     def draw(self, primitive=GL.GL_TRIANGLES):
-        GL.glBindVertexArray(self.glid)  # activate our vertex array
+        state.bind_vertex_array(self.glid)  # activate our vertex array
         if self.size is not None:
             GL.glDrawElements(primitive, self.size, GL.GL_UNSIGNED_INT, None)
+            state.count_draw(self.size, primitive=primitive)
         else:
             GL.glDrawArrays(primitive, 0, self.shape)
+            state.count_draw(self.shape, primitive=primitive)
 
     def __del__(self):
+        state.forget_vertex_array(self.glid)
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(1, self.buffers)
 
@@ -79,13 +110,10 @@ class ColorMesh (VertexArray):
         self.color = color
 
     def draw(self, projection, view, model, **param):
-        GL.glUseProgram(self.shader.glid)
-        matrix_location = GL.glGetUniformLocation(self.shader.glid, 'projection')
-        GL.glUniformMatrix4fv(matrix_location, 1, True, projection)
-        matrix_location = GL.glGetUniformLocation(self.shader.glid, 'view')
-        GL.glUniformMatrix4fv(matrix_location, 1, True, view @ model)
-        loc = GL.glGetUniformLocation(self.shader.glid, 'inColor')
-        GL.glUniform3fv(loc, 1, self.color)
+        state.use_program(self.shader.glid)
+        self.shader.set_mat4('projection', projection)
+        self.shader.set_mat4('view', view @ model)
+        self.shader.set_vec3('inColor', self.color)
         super().draw()
 
 class PhongMesh (ColorMesh):
@@ -45,21 +45,107 @@ class TransformKeyFrames:
 
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    animated = False    # True for nodes whose transform changes every frame
+    updates = 0         # world transforms recomputed, over all nodes
+
     def __init__(self, name='', children=(), transform=identity(), **param):
+        self.parents = []   # nodes holding this one, whose bounds depend on it
         self.transform, self.param, self.name = transform, param, name
-        self.children = list(iter(children))
+        self.children = []
+        self._model = self._world = None    # cached parent and world transforms
+        self._param = self._merged = None   # cached parent and merged parameters
+        self.add(*children)
+
+    @property
+    def transform(self):
+        """ local transform, setting it invalidates the cached world transform """
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        self._transform, self._dirty = transform, True
+        for parent in getattr(self, 'parents', ()):
+            parent.invalidate()
+
+    def world(self, model):
+        """ world transform model @ self.transform, only recomputed when the
+            local transform or the parent transform model changed. Parents
+            pass their cached world, so unchanged ancestors cost a comparison """
+        if self._dirty or (model is not self._model and not np.array_equal(model, self._model)):
+            self._world, self._dirty = model @ self._transform, False
+            Node.updates += 1
+        self._model = model
+        return self._world
+
+    def merged(self, param):
+        """ named parameters given here merged with those of initialization """
+        if not self.param:
+            return param
+        previous = self._param
+        if (previous is None or param.keys() != previous.keys()
+                or any(value is not previous[key] for key, value in param.items())):
+            self._param, self._merged = param, dict(param, **self.param)
+        return self._merged
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
-
-    def draw(self, projection, view, model, win=None, **param):
-        """ Recursive draw, passing down named parameters & model matrix. """
+        for child in drawables:
+            if isinstance(child, Node):
+                child.parents.append(self)
+        self.refresh()
+
+    def refresh(self):
+        """ recompute whether a descendant moves, after children were added
+            here or below, and forget the cached bounds up the tree """
+        # children bounds can only be cached if no descendant moves
+        self.dynamic = any(getattr(child, 'animated', False) or getattr(child, 'dynamic', False)
+                           for child in self.children)
+        self._bounds = None
+        for parent in self.parents:
+            parent.refresh()
+
+    def invalidate(self):
+        """ forget the cached children bounds, a child transform changed, and
+            those of the ancestors. Ancestors only cache bounds once this node
+            has, so an empty cache here means none above """
+        if getattr(self, '_bounds', None) is not None:
+            self._bounds = None
+            for parent in self.parents:
+                parent.invalidate()
+
+    @property
+    def bounds(self):
+        """ bounding sphere of the subtree in the parent frame, None if unknown """
+        local = self._bounds
+        if local is None:
+            local = merge_spheres(getattr(child, 'bounds', None) for child in self.children)
+            if not self.dynamic:
+                self._bounds = local
+        return transform_sphere(self.transform, local)
+
+    def draw(self, projection, view, model, win=None, frustum=None, queue=None, **param):
+        """ Recursive draw, passing down named parameters & model matrix.
+            Children outside of the view frustum, if given, are skipped,
+            drawables are added to the render queue if given. """
         # merge named parameters given at initialization with those given here
-        param = dict(param, **self.param)
-        model = model @ self.transform
+        param = self.merged(param)
+        model = self.world(model)
         for child in self.children:
-            child.draw(projection, view, model, **param)
+            # animated children move before their bounds are tested, so that
+            # culling uses this frame's pose and culled ones keep animating
+            if getattr(child, 'animated', False):
+                child.animate(win)
+            if frustum is None or frustum.visible(child, model):
+                if queue is not None:
+                    queue.add(child, projection, view, model, win=win, frustum=frustum, **param)
+                else:
+                    child.draw(projection, view, model, win=win, frustum=frustum, **param)
+
+    def animate(self, win=None):
+        """ update the transform of animated nodes, called by their parent (or
+            the viewer for top level ones) before they are culled and drawn """
+        pass
 
     def on_key(self, _win, key, _scancode, action, _mods):
         """
@@ -75,27 +161,27 @@ class Node:
 
 class KeyFrameControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    animated = True
+
     def __init__(self, translate_keys, rotate_keys, scale_keys, **kwargs):
         super().__init__(**kwargs)
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
 
-    def draw(self, projection, view, model, **param):
-        """ When redraw requested, interpolate our node transform from keys """
+    def animate(self, win=None):
+        """ interpolate our node transform from keys """
         self.transform = self.keyframes.value(glfw.get_time())
-        super().draw(projection, view, model, **param)
 
 
 class RotationControlNode(Node):
+    animated = True
+
     def __init__(self, key_up, key_down, axis, angle=0, **param):
         super().__init__(**param)   # forward base constructor named arguments
         self.angle, self.axis = angle, axis
         self.key_up, self.key_down = key_up, key_down
 
-    def draw(self, projection, view, model, win=None, **param):
+    def animate(self, win=None):
         assert win is not None
         self.angle += 2 * int(glfw.get_key(win, self.key_up) == glfw.PRESS)
         self.angle -= 2 * int(glfw.get_key(win, self.key_down) == glfw.PRESS)
         self.transform = rotate(self.axis, self.angle)
-
-        # call Node's draw method to pursue the hierarchical tree calling
-        super().draw(projection, view, model, win=win, **param)
@@ -0,0 +1,136 @@
+"""
+Vectorized skeleton pose evaluation, independent of OpenGL.
+All the channels of a clip are stored in flat arrays so that the local
+transforms of every node at a given time are evaluated in one numpy pass,
+then composed into world transforms one hierarchy level at a time.
+"""
+import numpy as np
+
+
+class ChannelKeys:
+    """ keys of one component (translation, rotation or scaling) of many
+        channels, concatenated in flat arrays """
+    def __init__(self, keys):
+        """ keys: list of (times, values) pairs, one per channel """
+        counts = np.array([len(times) for times, _ in keys])
+        self.starts = np.cumsum(counts) - counts
+        self.lasts = self.starts + counts - 1
+        self.times = np.concatenate([np.asarray(times, np.float64) for times, _ in keys])
+        self.values = np.concatenate([np.asarray(values, np.float32).reshape(len(times), -1)
+                                      for times, values in keys])
+        # channels shifted apart so that one search finds the keys of all of them
+        self.first, self.last = self.times.min(), self.times.max()
+        span = self.last - self.first + 1
+        self.offsets = np.arange(len(keys)) * span
+        self.shifted = self.times + np.repeat(self.offsets, counts)
+
+    def search(self, time):
+        """ (..., channels) indices of the keys around time and fractions
+            between them, time being a scalar or an array of times """
+        # clamped to the keys, as KeyFrames hold the boundary values
+        time = np.clip(np.asarray(time, np.float64), self.first, self.last)[..., None]
+        before = np.searchsorted(self.shifted, time + self.offsets, side='right') - 1
+        before = np.clip(before, self.starts, np.maximum(self.lasts - 1, self.starts))
+        after = np.minimum(before + 1, self.lasts)
+        delta = self.times[after] - self.times[before]
+        fraction = np.zeros(before.shape)
+        np.divide(time - self.times[before], delta, out=fraction, where=delta > 0)
+        return before, after, np.clip(fraction, 0, 1)[..., None]
+
+    def lerp(self, time):
+        """ (..., channels, size) linearly interpolated values at time """
+        before, after, fraction = self.search(time)
+        start = self.values[before]
+        return start + fraction * (self.values[after] - start)
+
+    def slerp(self, time):
+        """ (..., channels, 4) spherically interpolated quaternions at time """
+        before, after, fraction = self.search(time)
+        q0, q1 = normalized(self.values[before]), normalized(self.values[after])
+        dot = (q0 * q1).sum(axis=-1, keepdims=True)
+
+        # shorter path: reverse q1 when the quaternions have opposite handedness
+        q1, dot = np.where(dot > 0, q1, -q1), np.abs(dot)
+
+        theta = np.arccos(np.clip(dot, -1, 1)) * fraction
+        q2 = normalized(q1 - q0*dot)        # {q0, q2} orthonormal basis
+        return q0*np.cos(theta) + q2*np.sin(theta)
+
+
+def normalized(vectors):
+    """ unit vectors along the last axis, null vectors being left unchanged """
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norm > 0, norm, 1)
+
+
+def hierarchy_levels(parents):
+    """ node indices grouped by depth in a hierarchy given by parent indices
+        (-1 for roots, parents before children): each level only depends on
+        the previous ones """
+    depths = np.zeros(len(parents), np.intp)
+    for node, parent in enumerate(parents):
+        depths[node] = depths[parent] + 1 if parent >= 0 else 0
+    return [np.flatnonzero(depths == depth) for depth in range(depths.max(initial=-1) + 1)]
+
+
+def propagate(local, parents, levels, root=None):
+    """ (..., nodes, 4, 4) world transforms of local transforms, in place,
+        with one batched matrix product per hierarchy level """
+    world = local
+    if root is not None and levels:
+        world[..., levels[0], :, :] = root @ world[..., levels[0], :, :]
+    for level in levels[1:]:
+        world[..., level, :, :] = world[..., parents[level], :, :] @ world[..., level, :, :]
+    return world
+
+
+def compose_trs(translations, quaternions, scales):
+    """ (..., 4, 4) matrices translate @ quaternion_matrix @ scale, batched """
+    w, x, y, z = np.moveaxis(normalized(quaternions), -1, 0)
+    matrices = np.zeros(w.shape + (4, 4), np.float32)
+    matrices[..., 0, 0] = 1 - 2*(y*y + z*z)
+    matrices[..., 0, 1] = 2*(x*y - w*z)
+    matrices[..., 0, 2] = 2*(x*z + w*y)
+    matrices[..., 1, 0] = 2*(x*y + w*z)
+    matrices[..., 1, 1] = 1 - 2*(x*x + z*z)
+    matrices[..., 1, 2] = 2*(y*z - w*x)
+    matrices[..., 2, 0] = 2*(x*z - w*y)
+    matrices[..., 2, 1] = 2*(y*z + w*x)
+    matrices[..., 2, 2] = 1 - 2*(x*x + y*y)
+    matrices[..., :3, :3] *= scales[..., None, :]
+    matrices[..., :3, 3] = translations
+    matrices[..., 3, 3] = 1
+    return matrices
+
+
+class SkeletonPose:
+    """
+    Pose of a skeleton animated by one clip. Nodes are indexed in topological
+    order (parents before children), given by their parent index, -1 for
+    roots, and their rest local transforms used when they have no channel.
+    """
+    def __init__(self, parents, rest, channels):
+        """ channels: node index -> (position, rotation, scaling) (times, values) keys """
+        self.parents = np.asarray(parents, np.intp)
+        self.rest = np.asarray(rest, np.float32).reshape(-1, 4, 4)
+        self.animated = np.array(sorted(channels), np.intp)
+        trs = [channels[node] for node in self.animated]
+        self.translation, self.rotation, self.scaling = (
+            ChannelKeys([keys[component] for keys in trs]) if trs else None
+            for component in range(3))
+
+        self.levels = hierarchy_levels(self.parents)
+
+    def local(self, time):
+        """ (..., nodes, 4, 4) local transforms at time (scalar or array) """
+        shape = np.shape(time)
+        local = np.array(np.broadcast_to(self.rest, shape + self.rest.shape))
+        if self.animated.size:
+            local[..., self.animated, :, :] = compose_trs(
+                self.translation.lerp(time), self.rotation.slerp(time),
+                self.scaling.lerp(time))
+        return local
+
+    def world(self, time, root=None):
+        """ (..., nodes, 4, 4) world transforms at time, below root if given """
+        return propagate(self.local(time), self.parents, self.levels, root)
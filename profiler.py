@@ -0,0 +1,132 @@
+"""
+Frame instrumentation: CPU wall time of the frame stages and of every
+drawable, and GPU time of the drawables measured by GL_TIME_ELAPSED
+queries read back a few frames later, so that reading them never stalls.
+Timings export to Chrome trace-event JSON (chrome://tracing, Perfetto) and
+to a rolling console summary. Disabled, the only cost left is a flag test.
+"""
+import time
+import json
+from collections import deque, defaultdict
+from contextlib import nullcontext
+
+import OpenGL.GL as GL              # standard Python OpenGL wrapper
+
+NULL_SCOPE = nullcontext()
+
+
+class Scope:
+    """ context manager recording the CPU time of a stage """
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.profiler.record(self.name, 'stage', self.start, time.perf_counter() - self.start)
+
+
+class FrameProfiler:
+    """ rolling history of timed events, (frame, name, category, start, seconds) """
+
+    def __init__(self, history=120, latency=3, interval=2.0):
+        self.enabled = False
+        self.history = history      # frames kept for summaries and export
+        self.latency = latency      # frames before reading back a GPU query
+        self.interval = interval    # seconds between console summaries
+        self.trace_path = None      # Chrome trace written by Viewer on exit
+        self.frame = 0
+        self.events = deque()
+        self.pending = deque()      # (frame, name, start, query) not read back
+        self.queries = []           # free GL query objects
+        self.frame_start = self.last_report = time.perf_counter()
+
+    def stage(self, name):
+        """ context manager timing a frame stage, doing nothing when disabled """
+        return Scope(self, name) if self.enabled else NULL_SCOPE
+
+    def record(self, name, category, start, seconds, frame=None):
+        """ add a timed event, start being a time.perf_counter() value """
+        self.events.append((self.frame if frame is None else frame, name, category, start, seconds))
+
+    def begin_frame(self):
+        """ start timing a frame, reading back the GPU queries that are ready """
+        if not self.enabled:
+            return
+        self.frame += 1
+        self.collect()
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """ close the frame, forget old frames and print the summary when due """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record('frame', 'frame', self.frame_start, now - self.frame_start)
+        while self.events and self.events[0][0] <= self.frame - self.history:
+            self.events.popleft()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def draw(self, drawable, *args, **kwargs):
+        """ call drawable.draw, timing it on the CPU and on the GPU """
+        name = getattr(drawable, 'name', '') or type(drawable).__name__
+        query = self.queries.pop() if self.queries else GL.glGenQueries(1)[0]
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        start = time.perf_counter()
+        drawable.draw(*args, **kwargs)
+        self.record(name, 'cpu', start, time.perf_counter() - start)
+        GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        self.pending.append((self.frame, name, start, query))
+
+    def collect(self):
+        """ read back the GPU queries issued at least latency frames ago """
+        while self.pending and self.pending[0][0] <= self.frame - self.latency:
+            frame, name, start, query = self.pending[0]
+            if not GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE):
+                break       # GPU still behind, try again next frame
+            self.pending.popleft()
+            nanoseconds = GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT)
+            self.queries.append(query)
+            self.record(name, 'gpu', start, nanoseconds * 1e-9, frame)
+
+    def summary(self):
+        """ {(category, name): average milliseconds per frame} over the history """
+        frames = len({event[0] for event in self.events if event[2] == 'frame'}) or 1
+        totals = defaultdict(float)
+        for _, name, category, _, seconds in self.events:
+            totals[category, name] += seconds
+        return {key: total * 1e3 / frames for key, total in totals.items()}
+
+    def report(self):
+        """ print the rolling summary, stages then drawables by CPU time """
+        summary = self.summary()
+        frame = summary.get(('frame', 'frame'), 0)
+        print('frame %.2f ms (%.0f fps)' % (frame, 1e3 / frame if frame else 0))
+        for (category, name), ms in sorted(summary.items()):
+            if category == 'stage':
+                print('  %-24s %8.2f ms' % (name, ms))
+        names = sorted({name for category, name in summary if category == 'cpu'},
+                       key=lambda name: -summary['cpu', name])
+        for name in names:
+            print('  %-24s %8.2f ms cpu %8.2f ms gpu' %
+                  (name, summary['cpu', name], summary.get(('gpu', name), 0)))
+
+    def export(self, path):
+        """ write the history as Chrome trace events, GPU times on their own
+            track and placed at the CPU time the drawable was submitted """
+        tracks = {'frame': 0, 'stage': 1, 'cpu': 2, 'gpu': 3}
+        events = [dict(name=name, cat=category, ph='X', pid=0, tid=tracks[category],
+                       ts=start * 1e6, dur=seconds * 1e6, args=dict(frame=frame))
+                  for frame, name, category, start, seconds in self.events]
+        events += [dict(name='thread_name', ph='M', pid=0, tid=tid, args=dict(name=name))
+                   for name, tid in tracks.items()]
+        with open(path, 'w') as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
+        print('Saved frame trace %s\t(%d events)' % (path, len(events)))
+
+
+# process wide profiler, enabled by Viewer
+profiler = FrameProfiler()
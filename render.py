@@ -0,0 +1,121 @@
+"""
+Render queue: draw items sorted by pass, program, textures and vertex array,
+submitted through a GL state tracker that skips redundant binds and counts
+the remaining ones. Drawables bind through the tracker instead of calling
+glUseProgram, glBindTexture and glBindVertexArray themselves, and leave
+their state bound for the next item instead of unbinding it.
+"""
+import OpenGL.GL as GL              # standard Python OpenGL wrapper
+
+from profiler import profiler
+
+# render passes, drawn in this order
+PASS_OPAQUE, PASS_OVERLAY = 0, 1
+
+# drawable attributes holding the textures they bind
+TEXTURE_ATTRIBUTES = ('texture', 'normalMap', 'animation')
+
+
+class GLState:
+    """ currently bound program, textures and vertex array, binding on change """
+
+    def __init__(self):
+        self.binds = dict(program=0, texture=0, vertex_array=0)
+        self.draws = self.triangles = 0     # draw calls issued and triangles drawn
+        self.reset()
+
+    def reset(self):
+        """ forget the bound objects, so that the next binds are always issued """
+        self.program = self.vertex_array = self.unit = None
+        self.textures = {}      # (unit, target) -> texture
+
+    def use_program(self, glid):
+        """ make a program current """
+        if glid != self.program:
+            GL.glUseProgram(glid)
+            self.program = glid
+            self.binds['program'] += 1
+
+    def bind_texture(self, glid, unit=0, target=GL.GL_TEXTURE_2D):
+        """ bind a texture to a texture unit, leaving that unit active """
+        if self.unit != unit:
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            self.unit = unit
+        if self.textures.get((unit, target)) != glid:
+            GL.glBindTexture(target, glid)
+            self.textures[unit, target] = glid
+            self.binds['texture'] += 1
+
+    def bind_vertex_array(self, glid):
+        """ bind a vertex array object """
+        if glid != self.vertex_array:
+            GL.glBindVertexArray(glid)
+            self.vertex_array = glid
+            self.binds['vertex_array'] += 1
+
+    def count_draw(self, vertices, instances=1, primitive=GL.GL_TRIANGLES):
+        """ count a draw call and its triangles, vertices being the indices
+            or vertices drawn per instance """
+        self.draws += 1
+        if primitive == GL.GL_TRIANGLES:
+            self.triangles += vertices // 3 * instances
+
+    def forget_program(self, glid):
+        """ a program is deleted: unbind it if current """
+        if glid == self.program:
+            self.use_program(0)
+
+    def forget_texture(self, glid):
+        """ a texture is deleted, GL unbinds it from every unit """
+        self.textures = {key: texture for key, texture in self.textures.items()
+                         if texture != glid}
+
+    def forget_vertex_array(self, glid):
+        """ a vertex array is deleted, GL unbinds it if bound """
+        if glid == self.vertex_array:
+            self.vertex_array = 0
+
+
+# process wide state tracker, GL having a single context here
+state = GLState()
+
+
+def sort_key(drawable):
+    """ (pass, program, textures, vertex array) of a drawable exposing the
+        program it uses, None for containers which draw other drawables """
+    shader = getattr(drawable, 'shader', None) or getattr(drawable, 'skinning_shader', None)
+    if shader is None:
+        return None
+    textures = tuple(getattr(texture, 'glid', 0) for texture in
+                     (getattr(drawable, name, None) for name in TEXTURE_ATTRIBUTES)
+                     if texture is not None)
+    vertex_array = getattr(drawable, 'vertex_array', drawable)
+    return (getattr(drawable, 'render_pass', PASS_OPAQUE), shader.glid, textures,
+            getattr(vertex_array, 'glid', 0))
+
+
+class RenderQueue:
+    """ draw items of a frame, submitted sorted by their GL state """
+
+    def __init__(self):
+        self.items = []     # (sort key, insertion order, drawable, model, param)
+
+    def add(self, drawable, projection, view, model, **param):
+        """ queue a drawable, containers being drawn right away so that they
+            queue their own drawables, with this queue as parameter """
+        key = sort_key(drawable)
+        if key is None:
+            drawable.draw(projection, view, model, queue=self, **param)
+        else:
+            self.items.append((key, len(self.items), drawable, model, param))
+
+    def submit(self, projection, view):
+        """ draw the queued items, those sharing state one after the other """
+        self.items.sort(key=lambda item: item[:2])
+        if profiler.enabled:
+            for _, _, drawable, model, param in self.items:
+                profiler.draw(drawable, projection, view, model, **param)
+        else:
+            for _, _, drawable, model, param in self.items:
+                drawable.draw(projection, view, model, **param)
+        self.items = []
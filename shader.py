@@ -1,9 +1,14 @@
 # Python built-in modules
 import os                           # os function, i.e. checking file status
+import time                         # program build timings
+import hashlib                      # program source digests
+import weakref                      # registry of live programs
 
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
+from render import state            # bound GL objects tracking
+from startup import startup         # startup phase timings
 
 
 # ------------  Simple color shaders ------------------------------------------
@@ -50,11 +55,23 @@ void main() {
 
 # ------------ low level OpenGL object wrappers ----------------------------
 class Shader:
-    """ Helper class to create and automatically destroy shader program """
+    """ Helper class to create and automatically destroy shader program.
+        Programs of identical sources are compiled once and shared, and their
+        linked binaries can be cached on disk to skip compilation entirely """
+    registry = weakref.WeakValueDictionary()  # source digest -> Shader
+    cache_dir = None    # directory of the program binary cache, None disables it
+    timings = []        # (digest, 'compiled' or 'binary', seconds) per program
+    uploads = skipped = 0   # uniform uploads done and skipped as redundant
+
     @staticmethod
-    def _compile_shader(src, shader_type):
+    def _source(src):
+        """ shader source from a raw string or a source file name """
         src = open(src, 'r').read() if os.path.exists(src) else src
-        src = src.decode('ascii') if isinstance(src, bytes) else src
+        return src.decode('ascii') if isinstance(src, bytes) else src
+
+    @staticmethod
+    def _compile_shader(src, shader_type):
+        src = Shader._source(src)
         shader = GL.glCreateShader(shader_type)
         GL.glShaderSource(shader, src)
         GL.glCompileShader(shader)
@@ -68,15 +85,44 @@ class Shader:
             return None
         return shader
 
+    def __new__(cls, vertex_source, fragment_source):
+        """ shared program of these sources, created on first request """
+        vert, frag = cls._source(vertex_source), cls._source(fragment_source)
+        digest = hashlib.sha1((vert + '\0' + frag).encode('utf-8')).hexdigest()
+        shader = cls.registry.get(digest)
+        if shader is None:
+            shader = super().__new__(cls)
+            shader.digest, shader.glid = digest, None
+            shader.locations, shader.values = {}, {}
+            start = time.perf_counter()
+            with startup.phase('shader') as phase:
+                origin = 'binary' if shader._load_binary() else 'compiled'
+                if origin == 'compiled':
+                    shader._link(vert, frag)
+                    shader._save_binary()
+                phase.info['origin'] = origin
+            shader.time = time.perf_counter() - start
+            cls.timings.append((digest, origin, shader.time))
+            print('Shader %s %s in %.1f ms' % (digest[:8], origin, shader.time * 1000))
+            if shader.glid:
+                shader._introspect()
+                cls.registry[digest] = shader
+        return shader
+
     def __init__(self, vertex_source, fragment_source):
         """ Shader can be initialized with raw strings or source file names """
-        self.glid = None
+        # program already built or shared by __new__
+
+    def _link(self, vertex_source, fragment_source):
+        """ compile and link the program from its sources """
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
             self.glid = GL.glCreateProgram()  # pylint: disable=E1111
             GL.glAttachShader(self.glid, vert)
             GL.glAttachShader(self.glid, frag)
+            if self.cache_dir:
+                GL.glProgramParameteri(self.glid, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
             GL.glLinkProgram(self.glid)
             GL.glDeleteShader(vert)
             GL.glDeleteShader(frag)
@@ -85,7 +131,107 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
+
+    def _introspect(self):
+        """ cache the locations of all active uniforms, arrays by base name """
+        for index in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
+            name, _size, _type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii') if isinstance(name, bytes) else name
+            location = GL.glGetUniformLocation(self.glid, name)
+            self.locations[name[:-3] if name.endswith('[0]') else name] = location
+
+    def location(self, name):
+        """ cached location of a uniform, -1 if not active in the program """
+        location = self.locations.get(name)
+        if location is None:
+            location = self.locations[name] = GL.glGetUniformLocation(self.glid, name)
+        return location
+
+    def _changed(self, location, value):
+        """ True if value must be uploaded at location, remembering it """
+        if location < 0:
+            return False
+        previous = self.values.get(location)
+        if previous is not None and np.array_equal(previous, value):
+            Shader.skipped += 1
+            return False
+        self.values[location] = np.array(value, copy=True)
+        Shader.uploads += 1
+        return True
+
+    # typed uniform setters, to be called while the program is in use
+    def set_mat4(self, name, matrix):
+        """ upload a row major 4x4 matrix, or a (N, 4, 4) array of them """
+        location = self.location(name)
+        matrix = np.asarray(matrix, np.float32)
+        if self._changed(location, matrix):
+            GL.glUniformMatrix4fv(location, matrix.size // 16, True, matrix)
+
+    def set_vec3(self, name, vector):
+        """ upload a 3 float vector """
+        location = self.location(name)
+        vector = np.asarray(vector, np.float32)
+        if self._changed(location, vector):
+            GL.glUniform3fv(location, 1, vector)
+
+    def set_float(self, name, value):
+        """ upload a float """
+        location = self.location(name)
+        if self._changed(location, value):
+            GL.glUniform1f(location, value)
+
+    def set_int(self, name, value):
+        """ upload an int, or the texture unit of a sampler """
+        location = self.location(name)
+        if self._changed(location, value):
+            GL.glUniform1i(location, value)
+
+    def _binary_path(self):
+        """ cache file of this program for the current driver, None if disabled """
+        if not self.cache_dir or not GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS):
+            return None
+        driver = b'|'.join(GL.glGetString(name) for name in
+                           (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION))
+        key = hashlib.sha1(driver + self.digest.encode('ascii')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.bin')
+
+    def _load_binary(self):
+        """ create the program from the binary cache, True on success """
+        path = self._binary_path()
+        if path is None or not os.path.exists(path):
+            return False
+        data = np.fromfile(path, np.uint8)
+        binary_format = int(data[:4].view(np.uint32)[0])
+        self.glid = GL.glCreateProgram()  # pylint: disable=E1111
+        GL.glProgramBinary(self.glid, binary_format, data[4:], data.size - 4)
+        if GL.glGetProgramiv(self.glid, GL.GL_LINK_STATUS):
+            return True
+        GL.glDeleteProgram(self.glid)  # driver rejected it, compile again
+        self.glid = None
+        return False
+
+    def _save_binary(self):
+        """ store the linked program binary in the cache """
+        path = self._binary_path()
+        if path is None or not self.glid:
+            return
+        length = GL.glGetProgramiv(self.glid, GL.GL_PROGRAM_BINARY_LENGTH)
+        binary = np.empty(length, np.uint8)
+        binary_format, written = np.zeros(1, np.uint32), np.zeros(1, np.int32)
+        GL.glGetProgramBinary(self.glid, length, written, binary_format, binary)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(binary_format.tobytes() + binary[:written[0]].tobytes())
+
+    @classmethod
+    def report(cls):
+        """ print the build time of every program created so far """
+        for digest, origin, seconds in cls.timings:
+            print('%s %-8s %8.2f ms' % (digest[:8], origin, seconds * 1000))
+        total = sum(seconds for _, _, seconds in cls.timings)
+        print('%d programs built, %d live, %.2f ms' % (len(cls.timings), len(cls.registry), total * 1000))
+
     def __del__(self):
-        GL.glUseProgram(0)
+        state.forget_program(self.glid)
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
@@ -1,11 +1,14 @@
-import pyassimp
+import os
 
 from mesh import *
 from node import *
+from bake import POSTPROCESS, load_scene, load_channels
+from cache import assets, cached_loader
 
 # -------------- Linear Blend Skinning : TP7 ---------------------------------
 MAX_VERTEX_BONES = 4
 MAX_BONES = 128
+SKINNED_BOUNDS_SCALE = 1.5
 
 # new shader for skinned meshes, fully compatible with previous color fragment
 # TODO: complete the loop for TP7 exercise 1
@@ -51,6 +54,45 @@ void main() {
 
 
 
+def bone_entries(bones):
+    """ flat (vertex ids, bone ids, weights) arrays of the weights of assimp bones """
+    entries = [(entry.vertexid, bone_id, entry.weight)
+               for bone_id, bone in enumerate(bones) for entry in bone.weights]
+    entries = np.array(entries, np.float64).reshape(-1, 3)
+    return entries[:, 0].astype(np.intp), entries[:, 1].astype(np.uint32), entries[:, 2]
+
+
+def pack_bone_weights(vertex_ids, bone_ids, weights, vertex_count, size=MAX_VERTEX_BONES):
+    """
+    Per vertex (vertex_count, size) bone ids and weights of the size most
+    influential bones, from flat (vertex, bone, weight) entries. Columns are
+    sorted by increasing weight, unused ones have id and weight 0, and the
+    kept weights are renormalized to sum to 1.
+    """
+    # compact (vertex_count, most influences per vertex) tables of entries
+    order = np.argsort(vertex_ids, kind='stable')
+    vertex_ids, bone_ids, weights = vertex_ids[order], bone_ids[order], weights[order]
+    counts = np.bincount(vertex_ids, minlength=vertex_count)
+    slots = np.arange(vertex_ids.size) - (np.cumsum(counts) - counts)[vertex_ids]
+    width = max(counts.max(initial=0), size)
+    table_weights = np.zeros((vertex_count, width), np.float32)
+    table_ids = np.zeros((vertex_count, width), np.uint32)
+    table_weights[vertex_ids, slots] = weights
+    table_ids[vertex_ids, slots] = bone_ids
+
+    # partial selection of the size highest weights, then sorted by weight, id
+    top = np.argpartition(table_weights, width - size, axis=1)[:, width - size:]
+    top_weights = np.take_along_axis(table_weights, top, axis=1)
+    top_ids = np.take_along_axis(table_ids, top, axis=1)
+    order = np.lexsort((top_ids, top_weights), axis=1)
+    top_weights = np.take_along_axis(top_weights, order, axis=1)
+    top_ids = np.take_along_axis(top_ids, order, axis=1)
+
+    total = top_weights.sum(axis=1, keepdims=True)
+    np.divide(top_weights, total, out=top_weights, where=total > 0)
+    return top_ids, top_weights
+
+
 class SkinnedMesh:
     """class of skinned mesh nodes in scene graph """
     def __init__(self, attributes, bone_nodes, bone_offsets, index=None):
@@ -58,37 +100,36 @@ class SkinnedMesh:
         # setup shader attributes for linear blend skinning shader
         self.vertex_array = VertexArray(attributes, index)
 
+        # bind pose bounds, enlarged since animation moves the vertices around
+        center, radius = self.vertex_array.bounds
+        self.bounds = center, radius * SKINNED_BOUNDS_SCALE
+
         # feel free to move this up in Viewer as shown in previous practicals
         self.skinning_shader = Shader(SKINNING_VERT, COLOR_FRAG)
 
-        # store skinning data
-        self.bone_nodes = bone_nodes
-        self.bone_offsets = bone_offsets
+        # store skinning data, offsets stacked for the palette computation
+        self.bone_nodes = bone_nodes[:MAX_BONES]
+        self.bone_offsets = np.array(bone_offsets[:MAX_BONES], np.float32).reshape(-1, 4, 4)
 
     def draw(self, projection, view, _model, **_kwargs):
         """ skinning object draw method """
 
         shid = self.skinning_shader.glid
-        GL.glUseProgram(shid)
+        state.use_program(shid)
 
         # setup camera geometry parameters
-        loc = GL.glGetUniformLocation(shid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
-        loc = GL.glGetUniformLocation(shid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-
-        # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
+        self.skinning_shader.set_mat4('projection', projection)
+        self.skinning_shader.set_mat4('view', view)
 
-            bone_loc = GL.glGetUniformLocation(shid, 'boneMatrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, 1, True, bone_matrix)
+        # bone world transform matrices need to be passed for skinning,
+        # computed as one (N, 4, 4) palette and uploaded in a single call
+        if self.bone_nodes:
+            worlds = np.array([node.world_transform for node in self.bone_nodes], np.float32)
+            self.skinning_shader.set_mat4('boneMatrix', worlds @ self.bone_offsets)
 
         # draw mesh vertex array
         self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # leave with clean OpenGL state, to make it easier to detect problems
-        GL.glUseProgram(0)
     def print_pretty(self, indent="") :
         print(indent, self)
 
@@ -96,6 +137,8 @@ class SkinnedMesh:
 # -------- Skinning Control for Keyframing Skinning Mesh Bone Transforms ------
 class SkinningControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    animated = True
+
     def __init__(self, *keys, **kwargs):
         super().__init__(**kwargs)
         self.keyframes = TransformKeyFrames(*keys) if keys[0] else None
@@ -103,17 +146,24 @@ class SkinningControlNode(Node):
         self.time = 0;
 
 
-    def draw(self, projection, view, model, **param):
-        """ When redraw requested, interpolate our node transform from keys """
+    def animate(self, win=None):
+        """ interpolate our node transform from keys """
         if self.keyframes:  # no keyframe update should happens if no keyframes
             self.transform = self.keyframes.value(glfw.get_time() - self.time)
 
+    def draw(self, projection, view, model, **param):
+        """ draw the subtree, the transform being animated by the parent """
         # store world transform for skinned meshes using this node as bone
-        self.world_transform = model @ self.transform
+        self.world_transform = self.world(model)
 
         # default node behaviour (call children's draw method)
         super().draw(projection, view, model, **param)
 
+    @property
+    def bounds(self):
+        """ skeletons are never culled, all bone transforms must be updated """
+        return None
+
     def on_key(self, _win, key, _scancode, action, _mods):
         pass
 
@@ -214,81 +264,150 @@ class SkinnedCylinder(SkinningControlNode):
 
 
 # -------------- 3D resource loader -------------------------------------------
-def load_skinned(file):
-    """load resources from file using pyassimp, return node hierarchy """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
-        return []
+def channel_keyframes(trs):
+    """ TransformKeyFrames of a (position, rotation, scaling) (times, values) channel """
+    # store trs dict with {times: transforms} for each animation bone
+    return TransformKeyFrames(*(dict(zip(times.tolist(), values)) for times, values in trs))
+
 
-    # ----- load animations
-    def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.time / ticks_per_second: key.value for key in assimp_keys}
-
-    # load first animation in scene file (could be a loop over all animations)
-    transform_keyframes = {}
-    if scene.animations:
-        anim = scene.animations[0]
-        for channel in anim.channels:
-            # for each animation bone, store trs dict with {times: transforms}
-            # (pyassimp name storage bug, bytes instead of str => convert it)
-            transform_keyframes[channel.nodename.data.decode('utf-8')] = (
-                conv(channel.positionkeys, anim.tickspersecond),
-                conv(channel.rotationkeys, anim.tickspersecond),
-                conv(channel.scalingkeys, anim.tickspersecond)
-            )
-
-    # ---- prepare scene graph nodes
-    # create SkinningControlNode for each assimp node.
+def make_skeleton(scene):
+    """ SkinningControlNode hierarchy of a BakedScene, animated by its first
+        animation; returns the root node and a name -> (node, BakedNode) dict """
+    # create SkinningControlNode for each scene node.
     # node creation needs to happen first as SkinnedMeshes store an array of
     # these nodes that represent their bone transforms
-    nodes = {}  # nodes: string name -> node dictionary
-
-    def make_nodes(pyassimp_node):
-        """ Recursively builds nodes for our graph, matching pyassimp nodes """
-        trs_keyframes = transform_keyframes.get(pyassimp_node.name, (None,))
-
-        node = SkinningControlNode(*trs_keyframes, name=pyassimp_node.name,
-                                   transform=pyassimp_node.transformation)
-        nodes[pyassimp_node.name] = node, pyassimp_node
-        node.add(*(make_nodes(child) for child in pyassimp_node.children))
-        return node
+    nodes, created = {}, []
+    for baked_node in scene.nodes:
+        node = SkinningControlNode(None, name=baked_node.name, transform=baked_node.transform)
+        if baked_node.name in scene.channels:
+            node.keyframes = channel_keyframes(scene.channels[baked_node.name])
+        nodes[baked_node.name] = node, baked_node
+        created.append(node)
+        if baked_node.parent >= 0:    # parents are listed before their children
+            created[baked_node.parent].add(node)
+    return created[0], nodes
+
+
+def mesh_bone_weights(mesh):
+    """ per vertex bone ids and weights of a BakedMesh, for its first MAX_BONES bones """
+    entries = mesh.bone_entries[mesh.bone_entries[:, 1] < MAX_BONES]
+    return pack_bone_weights(entries[:, 0].astype(np.intp), entries[:, 1].astype(np.uint32),
+                             entries[:, 2], mesh.vertices.shape[0])
+
+
+@cached_loader
+def load_skinned(file, option=POSTPROCESS):
+    """load resources from file, return node hierarchy.
+    The hierarchy is shared by every caller, animation state included """
+    scene = load_scene(file, option)
+    if scene is None:
+        return []
 
-    root_node = make_nodes(scene.rootnode)
+    root_node, nodes = make_skeleton(scene)
 
     # ---- create SkinnedMesh objects
+    skinned_meshes = []
     for mesh in scene.meshes:
         # -- skinned mesh: weights given per bone => convert per vertex for GPU
-        # first, populate an array with MAX_BONES entries per vertex
-        v_bone = np.array([[(0, 0)]*MAX_BONES] * mesh.vertices.shape[0],
-                          dtype=[('weight', 'f4'), ('id', 'u4')])
-        for bone_id, bone in enumerate(mesh.bones[:MAX_BONES]):
-            for entry in bone.weights:  # weight,id pairs necessary for sorting
-                v_bone[entry.vertexid][bone_id] = (entry.weight, bone_id)
-
-        v_bone.sort(order='weight')             # sort rows, high weights last
-        v_bone = v_bone[:, -MAX_VERTEX_BONES:]  # limit bone size, keep highest
+        # keeping the MAX_VERTEX_BONES highest weights of each vertex
+        v_bone_ids, v_bone_weights = mesh_bone_weights(mesh)
 
         # prepare bone lookup array & offset matrix, indexed by bone index (id)
-        bone_nodes = [nodes[bone.name][0] for bone in mesh.bones]
-        bone_offsets = [bone.offsetmatrix for bone in mesh.bones]
+        bone_nodes = [nodes[name][0] for name in mesh.bone_names]
 
-        print(mesh.vertices.shape, ", ", mesh.normals.shape)
-        # initialize skinned mesh and store in pyassimp_mesh for node addition
-        mesh.skinned_mesh = SkinnedMesh(
-                [mesh.vertices, mesh.normals, v_bone['id'], v_bone['weight']],
-                bone_nodes, bone_offsets, mesh.faces
-        )
+        skinned_meshes.append(SkinnedMesh(
+                [mesh.vertices, mesh.normals, v_bone_ids, v_bone_weights],
+                bone_nodes, mesh.bone_offsets, mesh.faces
+        ))
 
-    # ------ add each mesh to its intended nodes as indicated by assimp
-    for final_node, assimp_node in nodes.values():
-        final_node.add(*(_mesh.skinned_mesh for _mesh in assimp_node.meshes))
+    # ------ add each mesh to its intended nodes as indicated by the scene
+    for final_node, baked_node in nodes.values():
+        final_node.add(*(skinned_meshes[index] for index in baked_node.meshes))
 
     nb_triangles = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
-          (len(scene.meshes), nb_triangles, len(nodes), len(scene.animations)))
-    pyassimp.release(scene)
+          (len(scene.meshes), nb_triangles, len(nodes), int(bool(scene.channels))))
     return [root_node]
+
+
+# -------------- Animation clips sharing one skeleton -------------------------
+class AnimationClip:
+    """ keyframes of the animated nodes of a skeleton, by node name """
+    def __init__(self, name, channels):
+        self.name, self.channels = name, channels
+        self.keyframes = {node: channel_keyframes(trs) for node, trs in channels.items()}
+        self.duration = max((float(times[-1]) for trs in channels.values()
+                             for times, _ in trs if len(times)), default=0)
+
+
+@cached_loader
+def load_clip(file, option=0):
+    """ first animation of a file, without building nor post-processing its
+        meshes: the node names the keys refer to are the same either way """
+    channels = load_channels(file, option)
+    if not channels:
+        return None
+    # Dinosaurus_walk.dae -> walk
+    name = os.path.splitext(os.path.basename(file))[0].partition('_')[2] or 'default'
+    clip = AnimationClip(name, channels)
+    print('Loaded clip %s from %s\t(%d channels, %.2f s)' % (name, file, len(channels), clip.duration))
+    return clip
+
+
+class ClipLibrary:
+    """
+    Animation clips played on the skeleton of an already loaded skinned
+    hierarchy: only the animation channels of the clip files are imported,
+    and switching clips swaps node keyframes without touching GPU buffers.
+    The root node is left to its owner, which places the whole model.
+    """
+    def __init__(self, root, files=()):
+        self.root = root
+        self.nodes = {}     # name -> SkinningControlNode of the skeleton
+        self.meshes = []    # skinned meshes animated by the skeleton
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SkinningControlNode):
+                self.nodes.setdefault(node.name, node)
+                stack.extend(node.children)
+            elif hasattr(node, 'bone_nodes'):
+                self.meshes.append(node)
+        self.rest = {name: node.transform for name, node in self.nodes.items()}
+        self.clips = {}
+        self.order = []     # clip names, in the order of their files
+        self.loaded = []    # clips taken from the asset cache
+        self.active = None
+        for file in files:
+            self.add(file)
+
+    def add(self, file, name=None):
+        """ import the animation of a file as a clip, returns its name """
+        clip = load_clip(file)
+        if clip is None:
+            return None
+        self.loaded.append(clip)
+        missing = set(clip.keyframes) - set(self.nodes)
+        if missing:
+            print('Clip %s animates %d nodes unknown to the skeleton' % (file, len(missing)))
+        name = name or clip.name
+        if name not in self.clips:
+            self.order.append(name)
+        self.clips[name] = clip
+        return name
+
+    def __del__(self):  # give the clips back to the asset cache
+        for clip in self.loaded:
+            assets.release(clip)
+
+    def play(self, name):
+        """ make a clip the active animation of the skeleton, from its start """
+        clip, now = self.clips[name], glfw.get_time()
+        for node_name, node in self.nodes.items():
+            if node is self.root:
+                continue
+            node.keyframes = clip.keyframes.get(node_name)
+            node.time = now
+            if node.keyframes is None:  # not animated by this clip: rest pose
+                node.transform = self.rest[node_name]
+        self.active = name
@@ -3,7 +3,10 @@ from PIL import Image
 
 from texture import *
 from shader import Shader
+from render import state
 from loader import load
+from startup import startup
+from cache import assets
 
 VERT = """#version 330 core
 layout (location = 0) in vec3 aPos;
@@ -90,31 +93,36 @@ class Skybox:
 
         self.shader = Shader(VERT, FRAG)
         
-        self.vertexArray = load("skybox/skybox.obj")[0]
+        self.meshes = load("skybox/skybox.obj")
+        self.vertexArray = self.meshes[0]
 
-        original =  Image.open(file).resize((4*RESOLUTION,3*RESOLUTION))
-        self.texture_id = GL.glGenTextures(1)
+        with startup.phase('decode', file=file):
+            original =  Image.fromarray(decoded(file)).resize((4*RESOLUTION,3*RESOLUTION))
+        with startup.phase('upload', file=file):
+            self.texture_id = GL.glGenTextures(1)
 
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, self.texture_id)
+            state.bind_texture(self.texture_id, 0, GL.GL_TEXTURE_CUBE_MAP)
 
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-        original.crop((RESOLUTION*2, RESOLUTION, RESOLUTION*3, RESOLUTION*2)).tobytes())
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_X, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-        original.crop((0, RESOLUTION, RESOLUTION, RESOLUTION*2)).tobytes())
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_Y, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-         original.crop((RESOLUTION, 0, RESOLUTION*2, RESOLUTION)).tobytes())
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_Y, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-         original.crop((RESOLUTION, RESOLUTION*2, RESOLUTION*2, RESOLUTION*3)).tobytes())
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_Z, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-         original.crop((RESOLUTION, RESOLUTION, RESOLUTION*2, RESOLUTION*2)).tobytes())
-        GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_Z, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-         original.crop((RESOLUTION*3, RESOLUTION, RESOLUTION*4, RESOLUTION*2)).tobytes())
-        print (2)
-        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_S, GL.GL_REPEAT)
-        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_T, GL.GL_REPEAT)
-        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_R, GL.GL_REPEAT)
-        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
-        GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+            original.crop((RESOLUTION*2, RESOLUTION, RESOLUTION*3, RESOLUTION*2)).tobytes())
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_X, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+            original.crop((0, RESOLUTION, RESOLUTION, RESOLUTION*2)).tobytes())
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_Y, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+             original.crop((RESOLUTION, 0, RESOLUTION*2, RESOLUTION)).tobytes())
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_Y, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+             original.crop((RESOLUTION, RESOLUTION*2, RESOLUTION*2, RESOLUTION*3)).tobytes())
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_Z, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+             original.crop((RESOLUTION, RESOLUTION, RESOLUTION*2, RESOLUTION*2)).tobytes())
+            GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_NEGATIVE_Z, 0, GL.GL_RGB, RESOLUTION, RESOLUTION, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+             original.crop((RESOLUTION*3, RESOLUTION, RESOLUTION*4, RESOLUTION*2)).tobytes())
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_S, GL.GL_REPEAT)
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_T, GL.GL_REPEAT)
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_WRAP_R, GL.GL_REPEAT)
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+            GL.glTexParameteri(GL.GL_TEXTURE_CUBE_MAP, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+            self.file, self.nbytes = file, 6 * RESOLUTION * RESOLUTION * 3
+            startup.uploaded(self.nbytes)
+            memory.add(self)
 
     def drawskybox(self, projection, view):
         """
@@ -122,22 +130,22 @@ class Skybox:
         """
 
         GL.glDepthMask(False)
-        GL.glUseProgram(self.shader.glid)
-        GL.glUniformMatrix4fv(GL.glGetUniformLocation(self.shader.glid, 'projection'), 1, True, projection)
-        GL.glUniformMatrix4fv(GL.glGetUniformLocation(self.shader.glid, 'view'), 1, True, view)
+        state.use_program(self.shader.glid)
+        self.shader.set_mat4('projection', projection)
+        self.shader.set_mat4('view', view)
 
         # texture access setups
-        loc = GL.glGetUniformLocation(self.shader.glid, 'skybox')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, self.texture_id)
-        GL.glUniform1i(loc, 0)
+        self.shader.set_int('skybox', 0)
+        state.bind_texture(self.texture_id, 0, GL.GL_TEXTURE_CUBE_MAP)
 
         self.vertexArray.draw()
 
 
         GL.glDepthMask(True)
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, 0)
-        GL.glUseProgram(0)
+
+    def __del__(self):
+        GL.glDeleteTextures([self.texture_id])
+        assets.release(self.meshes)
 
 
 
@@ -0,0 +1,94 @@
+"""
+Startup profile: loading work timed as a tree of nested phases (window
+creation, file parses, image decodes, GPU uploads, shader builds...), with
+the bytes uploaded to the GPU by each phase, reported on the console and
+written to JSON to follow the time to first frame.
+"""
+import time
+import json
+
+
+class Phase:
+    """ timed startup phase, with its sub phases and own uploaded bytes """
+    def __init__(self, name, info):
+        self.name, self.info = name, info
+        self.children, self.nbytes, self.count = [], 0, 1
+        self.start, self.seconds = time.perf_counter(), 0
+
+    def total_bytes(self):
+        """ bytes uploaded by this phase and its sub phases """
+        return self.nbytes + sum(child.total_bytes() for child in self.children)
+
+    def as_dict(self):
+        """ JSON ready tree of the phase """
+        return dict(name=self.name, ms=self.seconds * 1e3, bytes=self.total_bytes(),
+                    count=self.count, **self.info,
+                    children=[child.as_dict() for child in self.children])
+
+
+class Scope:
+    """ context manager running a phase under the current one """
+    def __init__(self, profiler, phase):
+        self.profiler, self.phase = profiler, phase
+
+    def __enter__(self):
+        self.profiler.stack[-1].children.append(self.phase)
+        self.profiler.stack.append(self.phase)
+        self.phase.start = time.perf_counter()
+        return self.phase
+
+    def __exit__(self, *_):
+        phase = self.profiler.stack.pop()
+        phase.seconds = time.perf_counter() - phase.start
+
+        # repeated leaf phases, e.g. the vertex arrays of a model, merged in one
+        siblings = self.profiler.stack[-1].children
+        previous = siblings[-2] if len(siblings) > 1 else None
+        if (previous is not None and not previous.children and not phase.children
+                and (previous.name, previous.info) == (phase.name, phase.info)):
+            previous.seconds += phase.seconds
+            previous.nbytes += phase.nbytes
+            previous.count += 1
+            siblings.pop()
+
+
+class StartupProfiler:
+    """ tree of the phases run since the process started loading """
+
+    def __init__(self):
+        self.root = Phase('startup', {})
+        self.stack = [self.root]
+
+    def phase(self, name, **info):
+        """ context manager timing a phase, info being saved along with it """
+        return Scope(self, Phase(name, info))
+
+    def uploaded(self, nbytes):
+        """ account for bytes uploaded to the GPU by the current phase """
+        self.stack[-1].nbytes += int(nbytes)
+
+    def report(self, depth=2, phase=None, indent=''):
+        """ print the phases down to depth, slowest first """
+        phase = phase or self.finish()
+        label = phase.name + (' ' + str(phase.info['file']) if 'file' in phase.info else '')
+        label += ' x%d' % phase.count if phase.count > 1 else ''
+        print('%-48s %9.1f ms %9.1f MB' % ((indent + label)[:48], phase.seconds * 1e3,
+                                         phase.total_bytes() / 2**20))
+        if depth:
+            for child in sorted(phase.children, key=lambda child: -child.seconds):
+                self.report(depth - 1, child, indent + '  ')
+
+    def finish(self):
+        """ root phase, lasting until now """
+        self.root.seconds = time.perf_counter() - self.root.start
+        return self.root
+
+    def export(self, path):
+        """ write the phase tree to a JSON file """
+        with open(path, 'w') as file:
+            json.dump(self.finish().as_dict(), file, indent=1)
+        print('Saved startup profile %s\t(%.1f ms)' % (path, self.root.seconds * 1e3))
+
+
+# process wide startup profile, filled by the loaders
+startup = StartupProfiler()
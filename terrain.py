@@ -0,0 +1,160 @@
+"""
+Array based terrain geometry helpers, independent of OpenGL.
+Builds the vertex attributes and faces of a height map grid with numpy.
+"""
+import numpy as np
+
+
+def _scatter_add(faces, values, count):
+    """ sum per face values into the (count, 3) array of their vertices """
+    total = np.zeros((count, values.shape[1]))
+    for corner in faces.T:
+        for axis in range(values.shape[1]):
+            total[:, axis] += np.bincount(corner, values[:, axis], count)
+    return total
+
+
+def build_terrain(pixels, origin, widthScale, heightScale):
+    """
+    Builds the ground mesh from a (sizeZ, sizeX) array of height map values.
+    Returns vertices, texels, normals, tangents, bitangents and faces arrays,
+    vertices being stored row by row (x varies first).
+    """
+    sizeZ, sizeX = pixels.shape
+    z, x = np.mgrid[0:sizeZ, 0:sizeX]
+
+    #Vertices and texels
+    vertices = np.stack(((origin[0] + x)*widthScale,
+                         origin[1] + pixels*heightScale,
+                         (origin[2] + z)*widthScale), axis=-1).reshape(-1, 3)
+    texels = np.stack((x % 2, z % 2), axis=-1).reshape(-1, 2)
+
+    #Two triangles per grid cell, in the same order as the cells
+    faces = grid_faces(x + z*sizeX)
+
+    #Per face normal, tangent and bitangent
+    uFace = vertices[faces[:, 1]] - vertices[faces[:, 0]]
+    vFace = vertices[faces[:, 2]] - vertices[faces[:, 0]]
+    normal = np.cross(uFace, vFace)
+
+    deltaUV1 = texels[faces[:, 1]] - texels[faces[:, 0]]
+    deltaUV2 = texels[faces[:, 2]] - texels[faces[:, 0]]
+    diff = deltaUV1[:, 0] * deltaUV2[:, 1] - deltaUV1[:, 0] * deltaUV2[:, 0]
+    r = np.ones(diff.shape)
+    np.divide(1, diff, out=r, where=diff != 0)
+    tangent = (uFace * deltaUV2[:, 1:] - vFace * deltaUV1[:, 1:]) * r[:, None]
+    bitangent = (vFace * deltaUV1[:, :1] - uFace * deltaUV2[:, :1]) * r[:, None]
+
+    #Sum for each vertex, will be normalized in the shader.
+    count = vertices.shape[0]
+    normals = _scatter_add(faces, normal, count)
+    tangents = _scatter_add(faces, tangent, count)
+    bitangents = _scatter_add(faces, bitangent, count)
+
+    return vertices, texels, normals, tangents, bitangents, faces
+
+
+# Geomipmapping ----------------------------------------------------------------
+def grid_faces(ids):
+    """ two triangles per cell of a 2d array of vertex indices, as build_terrain """
+    c00, c01 = ids[:-1, :-1].ravel(), ids[:-1, 1:].ravel()
+    c10, c11 = ids[1:, :-1].ravel(), ids[1:, 1:].ravel()
+    faces = np.empty((c00.size, 2, 3), dtype=np.uint32)
+    faces[:, 0] = np.column_stack((c00, c10, c01))
+    faces[:, 1] = np.column_stack((c10, c11, c01))
+    return faces.reshape(-1, 3)
+
+
+def chunk_indices(size, step, edges=None):
+    """
+    Face indices of a chunk of size*size cells ((size+1)**2 vertices stored
+    row by row) drawn every step cells. edges gives the (north, east, south,
+    west) steps of the neighbours, z-1, x+1, z+1 and x-1 respectively: the
+    vertices of a side shared with a coarser neighbour are snapped onto the
+    coarser vertices so both chunks share the same border, without cracks.
+    """
+    north, east, south, west = (step,)*4 if edges is None else edges
+    ids = np.arange((size + 1)**2).reshape(size + 1, size + 1)
+    k = np.arange(size + 1)
+    ids[0, :] = ids[0, k // north * north]
+    ids[:, -1] = ids[k // east * east, -1]
+    ids[-1, :] = ids[-1, k // south * south]
+    ids[:, 0] = ids[k // west * west, 0]
+
+    faces = grid_faces(ids[::step, ::step])
+    degenerate = ((faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2])
+                  | (faces[:, 2] == faces[:, 0]))
+    return faces[~degenerate]
+
+
+def chunk_lods(distances, lodDistance, lods):
+    """ level of detail of each chunk, one more level each time distance doubles """
+    ratio = np.maximum(np.asarray(distances) / lodDistance, 1)
+    return np.minimum(np.log2(ratio).astype(int), lods - 1)
+
+
+def edge_steps(lods):
+    """
+    (nz, nx, 4) steps of the north, east, south and west sides of a (nz, nx)
+    grid of chunk lods: the step of the coarser of the chunk and its neighbour
+    """
+    steps = np.pad(2**lods, 1, mode='edge')
+    own = steps[1:-1, 1:-1]
+    return np.stack((np.maximum(own, steps[:-2, 1:-1]), np.maximum(own, steps[1:-1, 2:]),
+                     np.maximum(own, steps[2:, 1:-1]), np.maximum(own, steps[1:-1, :-2])),
+                    axis=-1)
+
+
+class HeightField:
+    """
+    Compact float32 height field of the ground, queried in map coordinates
+    (grid index + origin, i.e. world position / widthScale) with bilinear
+    sampling. Every query accepts scalars or numpy arrays of positions.
+    """
+    def __init__(self, heights, origin, widthScale, heightScale):
+        """ heights is the (sizeZ, sizeX) array of world heights """
+        self.heights = np.ascontiguousarray(heights, dtype=np.float32)
+        self.sizeZ, self.sizeX = self.heights.shape
+        self.origin = origin
+        self.widthScale = widthScale
+        self.heightScale = heightScale
+
+    def positions(self):
+        """ (sizeZ, sizeX) arrays of the x and z map coordinates of the grid """
+        return np.meshgrid(np.arange(self.sizeX) + self.origin[0],
+                           np.arange(self.sizeZ) + self.origin[2])
+
+    def _cells(self, xs, zs):
+        """ cell indices and fractions of positions, clamped to the map """
+        gx = np.clip(np.asarray(xs, dtype=np.float32) - self.origin[0], 0, self.sizeX - 1)
+        gz = np.clip(np.asarray(zs, dtype=np.float32) - self.origin[2], 0, self.sizeZ - 1)
+        ix = np.minimum(gx.astype(np.intp), self.sizeX - 2)
+        iz = np.minimum(gz.astype(np.intp), self.sizeZ - 2)
+        return ix, iz, gx - ix, gz - iz
+
+    def _corners(self, ix, iz):
+        """ heights of the 4 corners of the cells """
+        h = self.heights
+        return h[iz, ix], h[iz, ix + 1], h[iz + 1, ix], h[iz + 1, ix + 1]
+
+    def get_heights(self, xs, zs):
+        """ bilinearly interpolated world heights at the given positions """
+        ix, iz, fx, fz = self._cells(xs, zs)
+        h00, h10, h01, h11 = self._corners(ix, iz)
+        top = h00 + fx*(h10 - h00)
+        bottom = h01 + fx*(h11 - h01)
+        return (top + fz*(bottom - top))[()]
+
+    def get_slopes(self, x0s, z0s, x1s, z1s):
+        """ slope angles in degrees when moving from positions 0 to positions 1 """
+        delta = self.get_heights(x1s, z1s) - self.get_heights(x0s, z0s)
+        return (- np.degrees(np.arcsin(np.clip(delta/(255*self.heightScale), -1, 1))))[()]
+
+    def get_normals(self, xs, zs):
+        """ (..., 3) unit world normals of the interpolated surface """
+        ix, iz, fx, fz = self._cells(xs, zs)
+        h00, h10, h01, h11 = self._corners(ix, iz)
+        dx = ((h10 - h00)*(1 - fz) + (h11 - h01)*fz) / self.widthScale
+        dz = ((h01 - h00)*(1 - fx) + (h11 - h10)*fx) / self.widthScale
+        normals = np.stack((-dx, np.ones_like(dx), -dz), axis=-1)
+        return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
@@ -0,0 +1,48 @@
+"""
+Asset cache accounting of models holding textures cached on their own
+"""
+from cache import AssetCache
+
+
+class Asset:
+    """ plain stand-in for a GL object, holding nbytes of GPU memory """
+    def __init__(self, nbytes, **attributes):
+        self.nbytes = nbytes
+        self.__dict__.update(attributes)
+
+
+def load_model(cache, texture_key='texture'):
+    """ textured model whose texture is got from the cache while it loads,
+        as load_textured does through load_texture """
+    def load():
+        texture = cache.get(texture_key, lambda: Asset(60))
+        return [Asset(0, vertex_array=Asset(30), texture=texture)]
+    return cache.get('model', load)
+
+
+def test_model_bytes_leave_out_cached_textures():
+    cache = AssetCache(budget=95)
+    model = load_model(cache)
+    assert cache.entries['model'][2] == 30
+    assert cache.bytes == 90
+    cache.release(model)
+    assert cache.evictions == 0 and 'model' in cache.entries
+
+
+def test_released_model_evicts_its_textures():
+    cache = AssetCache(budget=95)
+    model = load_model(cache)
+    cache.budget = 50
+    cache.release(model)
+    assert cache.evictions == 2 and not cache.entries
+
+
+def test_shared_texture_kept_for_its_other_users():
+    cache = AssetCache(budget=95)
+    texture = cache.get('texture', lambda: Asset(60))
+    model = load_model(cache)
+    cache.budget = 50
+    cache.release(model)
+    assert list(cache.entries) == ['texture'] and cache.entries['texture'][1] == 1
+    cache.release(texture)
+    assert not cache.entries
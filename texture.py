@@ -1,41 +1,410 @@
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
-import pyassimp
 import os
+import ctypes
+import functools
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from mesh import *
+from bake import POSTPROCESS, load_scene
+from cache import cached_loader, assets
+from startup import startup
+
+# -------------- Image decoding on worker threads ----------------------------
+# PIL decoders release the GIL, images decode in parallel while the main
+# thread loads geometry; the GL upload stays on the main thread
+DECODE_WORKERS = os.cpu_count() or 1
+decoder = None      # thread pool, created on first prefetch
+prefetched = {}     # absolute path -> future of the decoded pixels
+
+
+def decode_image(file):
+    """ pixels of an image file as a numpy array, rows first """
+    with Image.open(file) as image:
+        return np.array(image)
+
+
+def prefetch(*files):
+    """ start decoding image files on the thread pool, for Textures made later """
+    global decoder
+    if decoder is None:
+        decoder = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix='decode')
+    for file in files:
+        path = os.path.abspath(file)
+        if path not in prefetched:
+            prefetched[path] = decoder.submit(decode_image, file)
+
+
+def decoded(file):
+    """ pixels of an image file, waiting for its prefetch if any """
+    future = prefetched.pop(os.path.abspath(file), None)
+    return decode_image(file) if future is None else future.result()
+
+
+def drop_prefetched():
+    """ forget the prefetched images no Texture used, return their paths """
+    unused = list(prefetched)
+    prefetched.clear()
+    return unused
+
+
+# -------------- Streaming upload through pixel buffer objects --------------
+STREAM_MIN_PIXELS = 512 * 512   # smaller images are uploaded at once
+STREAM_SYNC_PIXELS = 64 * 64    # mip levels this small never wait a frame
+
+
+def mipmaps(pixels):
+    """ mip chain of an image, finest first, each level box filtered from
+        the previous one down to 1x1 with the sizes GL expects """
+    levels = [pixels]
+    while max(levels[-1].shape[:2]) > 1:
+        height, width = levels[-1].shape[:2]
+        size = (max(width // 2, 1), max(height // 2, 1))
+        levels.append(np.asarray(Image.fromarray(levels[-1]).resize(size, Image.BOX)))
+    return levels
+
+
+class TextureStreamer:
+    """
+    Uploads mip levels of textures over several frames, coarse levels first,
+    at most budget bytes per frame (and at least one band of rows), through
+    an orphaned pixel buffer object the driver copies from asynchronously.
+    The base level of a texture is lowered as soon as a finer level is
+    complete, so it is sampled at its best available resolution meanwhile.
+    """
+    def __init__(self, budget=4 << 20):
+        self.budget = budget
+        self.pending = deque()      # (texture, format, level, pixels, next row)
+        self.buffer = None          # pixel unpack buffer, created on first use
+
+    def add(self, texture, format, levels):
+        """ queue the levels of a texture whose storage is allocated, the
+            small coarse ones are uploaded right away to make it complete """
+        base = len(levels)
+        while base > 0 and np.prod(levels[base - 1].shape[:2]) <= STREAM_SYNC_PIXELS:
+            base -= 1
+            height, width = levels[base].shape[:2]
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, base, 0, 0, width, height,
+                               format, GL.GL_UNSIGNED_BYTE, np.ascontiguousarray(levels[base]))
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, base)
+        for level in reversed(range(base)):
+            self.pending.append([texture, format, level, levels[level], 0])
+
+    def update(self):
+        """ upload the next rows of the queued levels within the frame budget """
+        budget = self.budget
+        while self.pending and budget > 0:
+            item = self.pending[0]
+            texture, format, level, pixels, row = item
+            height, width = pixels.shape[:2]
+            row_bytes = pixels[0].nbytes
+            rows = min(height - row, max(budget // row_bytes, 1))
+            band = np.ascontiguousarray(pixels[row:row + rows])
+
+            # write the rows in a fresh buffer store, no wait on the previous copy
+            if self.buffer is None:
+                self.buffer = GL.glGenBuffers(1)
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self.buffer)
+            GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, band.nbytes, None, GL.GL_STREAM_DRAW)
+            address = GL.glMapBufferRange(GL.GL_PIXEL_UNPACK_BUFFER, 0, band.nbytes,
+                                          GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT)
+            ctypes.memmove(address, band.ctypes.data, band.nbytes)
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+            state.bind_texture(texture.glid)
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, level, 0, row, width, rows,
+                               format, GL.GL_UNSIGNED_BYTE, None)
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+            budget -= band.nbytes
+            item[4] = row + rows
+            if item[4] == height:   # level complete, sample it from now on
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, level)
+                self.pending.popleft()
+
+    def __del__(self):
+        if self.buffer is not None:
+            GL.glDeleteBuffers(1, [self.buffer])
+
+
+# process wide streamer, updated once per frame by the Viewer
+streamer = TextureStreamer()
+
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
+# internal format, pixel format and swizzle of images by channel count, one
+# and two channel images being sampled as luminance and luminance alpha
+PIXEL_FORMATS = {1: (GL.GL_R8, GL.GL_RED, (GL.GL_RED, GL.GL_RED, GL.GL_RED, GL.GL_ONE)),
+                 2: (GL.GL_RG8, GL.GL_RG, (GL.GL_RED, GL.GL_RED, GL.GL_RED, GL.GL_GREEN)),
+                 3: (GL.GL_RGB8, GL.GL_RGB, None),
+                 4: (GL.GL_RGBA8, GL.GL_RGBA, None)}
+SWIZZLES = (GL.GL_TEXTURE_SWIZZLE_R, GL.GL_TEXTURE_SWIZZLE_G,
+            GL.GL_TEXTURE_SWIZZLE_B, GL.GL_TEXTURE_SWIZZLE_A)
+
+# texture priorities: low priority textures are downscaled to fit the budget
+PRIORITY_LOW, PRIORITY_HIGH = 0, 1
+
+
+def channels(pixels):
+    """ channel count of an image array, rows first """
+    return 1 if len(pixels.shape) == 2 else pixels.shape[2]
+
+
+def pixel_format(pixels):
+    """ GL internal format and format of an image array by its channel count """
+    return PIXEL_FORMATS[channels(pixels)][:2]
+
+
+def set_swizzle(target, pixels):
+    """ sample one and two channel images as luminance (alpha) in shaders """
+    swizzle = PIXEL_FORMATS[channels(pixels)][2]
+    for parameter, source in zip(SWIZZLES, swizzle or ()):
+        GL.glTexParameteri(target, parameter, source)
+
+
+def texture_bytes(width, height, channels, layers=1):
+    """ bytes of a texture with its full mip chain """
+    size = 0
+    while True:
+        size += width * height * channels * layers
+        if width == height == 1:
+            return size
+        width, height = max(width // 2, 1), max(height // 2, 1)
+
+
+class TextureMemory:
+    """ GPU memory held by live textures, against a budget met by uploading
+        low priority textures from a smaller base level, and by dropping the
+        finest levels of loaded low priority textures for high priority ones """
+    def __init__(self, budget=256 << 20, max_reduction=3):
+        self.budget = budget                # bytes, None for no limit
+        self.max_reduction = max_reduction  # mip levels a texture may lose
+        self.textures = weakref.WeakSet()   # objects with nbytes, file or name
+
+    def add(self, texture):
+        """ account for a texture whose nbytes are set """
+        self.textures.add(texture)
+
+    @property
+    def usage(self):
+        """ bytes held by the live textures """
+        return sum(texture.nbytes for texture in self.textures)
+
+    def reduction(self, width, height, channels, priority=PRIORITY_LOW):
+        """ mip levels to drop from an image about to be uploaded so that it
+            fits in the budget, high priority images are never reduced """
+        if self.budget is None:
+            return 0
+        if priority >= PRIORITY_HIGH:
+            self.make_room(texture_bytes(width, height, channels))
+            return 0
+        usage, drop = self.usage, 0
+        while (usage + texture_bytes(width, height, channels) > self.budget
+               and drop < self.max_reduction and max(width, height) > 1):
+            width, height, drop = max(width // 2, 1), max(height // 2, 1), drop + 1
+        return drop
+
+    def make_room(self, nbytes):
+        """ drop the finest level of the largest loaded low priority textures
+            until nbytes more fit in the budget or none can lose detail """
+        while self.usage + nbytes > self.budget:
+            textures = [texture for texture in self.textures
+                        if getattr(texture, 'priority', PRIORITY_HIGH) < PRIORITY_HIGH
+                        and texture.reduced < self.max_reduction and texture.droppable()]
+            if not textures:
+                return
+            max(textures, key=lambda texture: texture.nbytes).drop_level()
+
+    def report(self):
+        """ print the bytes of every live texture, largest first, and the usage """
+        textures = sorted(self.textures, key=lambda texture: -texture.nbytes)
+        for texture in textures:
+            name = getattr(texture, 'file', None) or type(texture).__name__
+            reduced = getattr(texture, 'reduced', 0)
+            print('%-48s %8.2f MB%s' % (name[:48], texture.nbytes / 2**20,
+                                        ' (1/%d)' % 2**reduced if reduced else ''))
+        budget = '%.1f MB' % (self.budget / 2**20) if self.budget is not None else 'none'
+        print('%d textures, %.1f MB, budget %s' % (len(textures), self.usage / 2**20, budget))
+
+
+# process wide texture memory accounting
+memory = TextureMemory()
+
+
 class Texture:
-    """ Helper class to create and automatically destroy textures """
+    """ Helper class to create and automatically destroy textures. Large
+        images are streamed by the streamer, coarse mip levels first """
+    target = GL.GL_TEXTURE_2D
+
     def __init__(self, file, wrap_mode=GL.GL_MIRRORED_REPEAT, min_filter=GL.GL_LINEAR,
-                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, priority=PRIORITY_LOW):
         self.glid = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
-        # helper array stores texture format for every pixel size 1..4
-        format = [GL.GL_LUMINANCE, GL.GL_LUMINANCE_ALPHA, GL.GL_RGB, GL.GL_RGBA]
+        self.file, self.shape, self.nbytes = file, None, 0
+        self.priority, self.reduced = priority, 0
         try:
             # imports image as a numpy array in exactly right format
-            tex = np.array(Image.open(file))
-            format = format[0 if len(tex.shape) == 2 else tex.shape[2] - 1]
-            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
-                            tex.shape[0], 0, format, GL.GL_UNSIGNED_BYTE, tex)
-
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, min_filter)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-            message = 'Loaded texture %s\t(%s, %s, %s, %s)'
-            print(message % (file, tex.shape, wrap_mode, min_filter, mag_filter))
+            with startup.phase('decode', file=file):
+                tex = decoded(file)
+            with startup.phase('upload', file=file):
+                self.upload(tex)
+                self.set_sampler(wrap_mode, min_filter, mag_filter)
+                startup.uploaded(self.nbytes)
+            message = 'Loaded texture %s\t(%s, %s, %s, %s%s)'
+            print(message % (file, tex.shape, wrap_mode, min_filter, mag_filter,
+                             ', reduced 1/%d' % 2**self.reduced if self.reduced else ''))
         except FileNotFoundError:
             print("ERROR: unable to load texture file %s" % file)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    def upload(self, tex):
+        """ allocate the texture with its mip chain and upload the pixels,
+            at once for small images, else queued to the streamer """
+        # base level downscaled when the texture budget is exceeded
+        self.reduced = memory.reduction(tex.shape[1], tex.shape[0], channels(tex), self.priority)
+        if self.reduced:
+            size = (max(tex.shape[1] >> self.reduced, 1), max(tex.shape[0] >> self.reduced, 1))
+            tex = np.asarray(Image.fromarray(tex).resize(size, Image.BOX))
+
+        internal, format = pixel_format(tex)
+        self.shape = tex.shape
+        state.bind_texture(self.glid)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)     # rows of any width
+        if tex.shape[0] * tex.shape[1] < STREAM_MIN_PIXELS:
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal, tex.shape[1],
+                            tex.shape[0], 0, format, GL.GL_UNSIGNED_BYTE, tex)
+            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+        else:
+            levels = mipmaps(tex)
+            for level, pixels in enumerate(levels):
+                GL.glTexImage2D(GL.GL_TEXTURE_2D, level, internal, pixels.shape[1],
+                                pixels.shape[0], 0, format, GL.GL_UNSIGNED_BYTE, None)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+            streamer.add(self, format, levels)
+        set_swizzle(self.target, tex)
+        self.nbytes = texture_bytes(tex.shape[1], tex.shape[0], channels(tex))
+        memory.add(self)
+
+    def droppable(self):
+        """ whether the finest level can be dropped: uploaded, not streaming,
+            and larger than 1x1 """
+        return (self.shape is not None and max(self.shape[:2]) > 1
+                and not any(item[0] is self for item in streamer.pending))
+
+    def drop_level(self):
+        """ free the finest mip level: sample from level 1 while its pixels
+            are read back, then move them to level 0 of a smaller storage """
+        state.bind_texture(self.glid)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, 1)
+        height, width = max(self.shape[0] // 2, 1), max(self.shape[1] // 2, 1)
+        internal, format = PIXEL_FORMATS[1 if len(self.shape) == 2 else self.shape[2]][:2]
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        pixels = GL.glGetTexImage(GL.GL_TEXTURE_2D, 1, format, GL.GL_UNSIGNED_BYTE)
+        pixels = np.frombuffer(pixels, np.uint8).reshape((height, width) + self.shape[2:])
+
+        # level 0 redefined smaller, the coarser levels regenerated from it
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal, width, height, 0, format,
+                        GL.GL_UNSIGNED_BYTE, pixels)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BASE_LEVEL, 0)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL,
+                           max(width, height).bit_length() - 1)
+        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+        self.shape, self.reduced = pixels.shape, self.reduced + 1
+        self.nbytes = texture_bytes(width, height, channels(pixels))
+        print('Reduced texture %s to 1/%d\t(%s)' % (self.file, 2**self.reduced, self.shape))
+
+    def set_sampler(self, wrap_mode, min_filter, mag_filter):
+        """ change how the texture is sampled, pixels are left untouched """
+        state.bind_texture(self.glid, target=self.target)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_MAG_FILTER, min_filter)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
 
     def __del__(self):  # delete GL texture from GPU when object dies
+        state.forget_texture(self.glid)
         GL.glDeleteTextures(self.glid)
 
+
+class TextureArray(Texture):
+    """ same sized images stacked in the layers of one 2D array texture, for
+        HUD and sprite drawables which pick their image with a layer uniform
+        and share a single texture bind """
+    target = GL.GL_TEXTURE_2D_ARRAY
+
+    def __init__(self, files, wrap_mode=GL.GL_MIRRORED_REPEAT, min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
+        self.glid = GL.glGenTextures(1)
+        self.priority, self.reduced = PRIORITY_HIGH, 0     # never downscaled
+        self.file, self.layers = ', '.join(files), {file: layer for layer, file in enumerate(files)}
+        prefetch(*files)
+        with startup.phase('decode', file=self.file):
+            images = [decoded(file) for file in files]
+        shapes = ['%s %s' % (file, image.shape) for file, image in zip(files, images)]
+        if any(image.shape != images[0].shape for image in images):
+            raise ValueError('array layers of different sizes: ' + ', '.join(shapes))
+        with startup.phase('upload', file=self.file):
+            self.upload(np.stack(images))
+            self.set_sampler(wrap_mode, min_filter, mag_filter)
+            startup.uploaded(self.nbytes)
+        print('Loaded texture array %s\t(%s)' % (self.file, self.shape,))
+
+    def upload(self, tex):
+        """ upload the (layers, height, width[, channels]) pixels with mipmaps """
+        self.shape = tex.shape
+        state.bind_texture(self.glid, target=self.target)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)     # rows of any width
+        internal, format = pixel_format(tex[0])
+        GL.glTexImage3D(self.target, 0, internal, tex.shape[2], tex.shape[1], tex.shape[0],
+                        0, format, GL.GL_UNSIGNED_BYTE, tex)
+        GL.glGenerateMipmap(self.target)
+        set_swizzle(self.target, tex[0])
+        self.nbytes = texture_bytes(tex.shape[2], tex.shape[1], channels(tex[0]), tex.shape[0])
+        memory.add(self)
+
+
+# -------------- Texture manager ---------------------------------------------
+# textures are shared through the asset cache, keyed by path, mtime and
+# sampler parameters, and material tokens resolved with a directory index
+@functools.lru_cache(maxsize=None)
+def texture_index(root):
+    """ image files below an asset root by file name, walked once per root,
+        files added later are not seen """
+    index = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            index.setdefault(name, os.path.join(directory, name))
+    return index
+
+
+def find_texture(root, token):
+    """ path of the file a material texture token names below root, None if
+        there is none. Token paths are often wrong, only the file name is
+        looked up, matching exactly or else by prefix either way """
+    name = token.split('/')[-1].split('\\')[-1]
+    index = texture_index(root)
+    if name in index:
+        return index[name]
+    return next((path for file, path in index.items()
+                 if name.startswith(file) or file.startswith(name)), None)
+
+
+@cached_loader
+def load_texture(file, wrap_mode=GL.GL_MIRRORED_REPEAT, min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, priority=PRIORITY_LOW):
+    """ Texture of an image file, shared by the users of the same sampler.
+        Sharers must not change its sampler, make a Texture to do so """
+    return Texture(file, wrap_mode, min_filter, mag_filter, priority)
+
+
+def texture_report():
+    """ print the GPU memory held by every texture against the budget """
+    shared = sum(key[1] == 'load_texture' for key in assets.entries)
+    print('%d textures shared through the asset cache' % shared)
+    memory.report()
+
+
 # -------------- Shaders ----------------------------------
 TEXTURE_VERT = """#version 330 core
 uniform mat4 modelviewprojection;
@@ -74,23 +443,16 @@ class TexturedMesh(VertexArray):
         self.texture = texture
 
     def draw(self, projection, view, model, win=None, **_kwargs):
-        GL.glUseProgram(self.shader.glid)
+        state.use_program(self.shader.glid)
 
         # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        self.shader.set_mat4('modelviewprojection', projection @ view @ model)
 
         # texture access setups
-        loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
+        self.shader.set_int('diffuseMap', 0)
+        state.bind_texture(self.texture.glid, 0)
         super().draw(GL.GL_TRIANGLES)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
-
     def setShaders(self, vert, frag):
         self.shader = Shader(vert, frag)
     def on_key(self, _win, key, _scancode, action, _mods):
@@ -125,67 +487,58 @@ class TexturedPlane:
         # some interactive elements
         if glfw.get_key(win, glfw.KEY_F6) == glfw.PRESS:
             self.wrap_mode = next(self.wrap)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+            self.texture.set_sampler(self.wrap_mode, *self.filter_mode)
 
         if glfw.get_key(win, glfw.KEY_F7) == glfw.PRESS:
             self.filter_mode = next(self.filter)
-            self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
+            self.texture.set_sampler(self.wrap_mode, *self.filter_mode)
 
-        GL.glUseProgram(self.shader.glid)
+        state.use_program(self.shader.glid)
 
         # projection geometry
-        loc = GL.glGetUniformLocation(self.shader.glid, 'modelviewprojection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection @ view @ model)
+        self.shader.set_mat4('modelviewprojection', projection @ view @ model)
 
         # texture access setups
-        loc = GL.glGetUniformLocation(self.shader.glid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
+        self.shader.set_int('diffuseMap', 0)
+        state.bind_texture(self.texture.glid, 0)
         self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
-
-def load_textured(file):
-    """ load resources using pyassimp, return list of TexturedMeshes """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+@cached_loader
+def load_textured(file, option=POSTPROCESS, priority=PRIORITY_LOW):
+    """ load resources from file, return list of TexturedMeshes, their
+        textures loaded with the given budget priority """
+    scene = load_scene(file, option)
+    if scene is None:
         return []  # error reading => return empty list
 
     # Note: embedded textures not supported at the moment
     path = os.path.dirname(file)
+    names = []
     for mat in scene.materials:
-        print(mat)
-        mat.tokens = dict(reversed(list(mat.properties.items())))
-        if 'file' in mat.tokens:  # texture file token
-            tname = mat.tokens['file'].split('/')[-1].split('\\')[-1]
+        name = None
+        if mat['file']:  # texture file token
             # search texture in file's whole subdir since path often screwed up
-            tname = [os.path.join(d[0], f) for d in os.walk(path) for f in d[2]
-                     if tname.startswith(f) or f.startswith(tname)]
-            if tname:
-                mat.texture = Texture(tname[0])
-            else:
-                print('Failed to find texture:', tname)
+            name = find_texture(path, mat['file'])
+            if name is None:
+                print('Failed to find texture:', mat['file'])
+        names.append(name)
+
+    # decode the images of every material at once, then upload them in turn
+    prefetch(*(name for name in names if name))
+    textures = [load_texture(name, priority=priority) if name else None for name in names]
 
     # prepare textured mesh
     meshes = []
     for mesh in scene.meshes:
-        texture = scene.materials[mesh.materialindex].texture
+        texture = textures[mesh.material]
 
         # tex coords in raster order: compute 1 - y to follow OpenGL convention
-        tex_uv = ((0, 1) + mesh.texturecoords[0][:, :2] * (1, -1)
-                  if mesh.texturecoords.size else None)
+        tex_uv = ((0, 1) + mesh.texcoords * (1, -1)
+                  if mesh.texcoords is not None else None)
 
         # create the textured mesh object from texture, attributes, and indices
         meshes.append(TexturedMesh(texture, [mesh.vertices, tex_uv], index=mesh.faces))
 
     size = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(scene.meshes), size))
-
-    pyassimp.release(scene)
     return meshes
@@ -0,0 +1,195 @@
+from texture_skin import *
+from pose import SkeletonPose
+from startup import startup
+from texture import memory
+
+# -------------- Animation textures: clips pre-sampled for the GPU -----------
+ANIMATION_RATE = 30     # sampled frames per second of animation
+
+# skinning shader fetching bone matrices of the two frames around the
+# current time from the animation texture, 4 texels (columns) per matrix
+BAKED_SKINNING_VERT = """#version 330 core
+// ---- camera geometry
+uniform mat4 projection, view, model;
+
+// ---- clip played: rows [clipStart, clipStart + clipFrames) of the texture
+uniform sampler2D animation;
+uniform int clipStart, clipFrames;
+uniform float time, rate;
+
+// ---- vertex attributes
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec2 tex_uv;
+layout(location = 2) in vec3 inNormal;
+layout(location = 3) in vec4 bone_ids;
+layout(location = 4) in vec4 bone_weights;
+
+// ----- interpolated attribute variables to be passed to fragment shader
+out vec2 fragTexCoord;
+out vec3 outNormal;
+
+mat4 boneMatrix(int bone, int frame) {
+    int x = 4 * bone, y = clipStart + frame;
+    return mat4(texelFetch(animation, ivec2(x, y), 0),
+                texelFetch(animation, ivec2(x + 1, y), 0),
+                texelFetch(animation, ivec2(x + 2, y), 0),
+                texelFetch(animation, ivec2(x + 3, y), 0));
+}
+
+void main() {
+    // ------ frames around the clip time, held on the last one at the end
+    float frame = clamp(time * rate, 0, clipFrames - 1);
+    int frame0 = int(frame);
+    int frame1 = min(frame0 + 1, clipFrames - 1);
+    float fraction = frame - frame0;
+
+    // ------ creation of the skinning deformation matrix
+    mat4 skinMatrix = mat4(0.);
+    for (int i=0; i < 4; i++) {
+        int bone = int(bone_ids[i]);
+        skinMatrix += bone_weights[i] * ((1 - fraction) * boneMatrix(bone, frame0)
+                                         + fraction * boneMatrix(bone, frame1));
+    }
+    skinMatrix = model * skinMatrix;
+
+    // ------ compute world and normalized eye coordinates of our vertex
+    mat4 Mat = projection * view * skinMatrix;
+    mat4 Mat2 = projection * skinMatrix;
+    gl_Position = Mat * vec4(position, 1.0);
+
+    outNormal = mat3(transpose(Mat2)) * inNormal;
+
+    fragTexCoord = tex_uv;
+}
+"""
+
+
+def sample_clip(root, clip, rest, rate=ANIMATION_RATE):
+    """
+    (frames, nodes) transforms relative to root of root and the
+    SkinningControlNodes below it, sampled every 1/rate second of the clip,
+    and the node order. Nodes the clip does not animate keep their rest
+    transform.
+    """
+    nodes, parents = [root], [-1]
+    stack = [(child, 0) for child in root.children]
+    while stack:
+        node, parent = stack.pop()
+        if isinstance(node, SkinningControlNode):
+            nodes.append(node)
+            parents.append(parent)
+            stack.extend((child, len(nodes) - 1) for child in node.children)
+
+    frames = int(np.ceil(clip.duration * rate)) + 1
+    times = np.minimum(np.arange(frames) / rate, clip.duration)
+    # root excluded: its own transform is applied at draw time
+    pose = SkeletonPose(parents, [identity()] + [rest[node.name] for node in nodes[1:]],
+                        {index: clip.channels[node.name] for index, node in enumerate(nodes)
+                         if index and node.name in clip.channels})
+    transforms = pose.world(times)
+    return transforms, nodes
+
+
+class AnimationTexture:
+    """ float texture of the bone palettes of every frame of several clips,
+        one row per frame and 4 RGBA texels (the columns) per bone """
+    def __init__(self, palettes):
+        """ palettes: name -> (frames, bones, 4, 4) row major matrices """
+        self.rows = {}      # clip name -> (first row, frame count)
+        first = 0
+        for name, palette in palettes.items():
+            self.rows[name] = first, palette.shape[0]
+            first += palette.shape[0]
+        data = np.concatenate([palette.transpose(0, 1, 3, 2) for palette in palettes.values()])
+        data = np.ascontiguousarray(data.reshape(first, -1, 4), np.float32)
+        self.nbytes = data.nbytes
+
+        self.glid = GL.glGenTextures(1)
+        state.bind_texture(self.glid)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA32F, data.shape[1], data.shape[0],
+                        0, GL.GL_RGBA, GL.GL_FLOAT, data)
+        startup.uploaded(data.nbytes)
+        memory.add(self)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+
+    def __del__(self):  # delete GL texture from GPU when object dies
+        state.forget_texture(self.glid)
+        GL.glDeleteTextures(self.glid)
+
+
+class BakedSkinnedMesh:
+    """ textured skinned mesh whose bones are read from an animation texture """
+    def __init__(self, mesh, animation, player):
+        # geometry and diffuse texture shared with the source mesh
+        self.vertex_array, self.texture = mesh.vertex_array, mesh.texture
+        self.animation, self.player = animation, player
+        self.skinning_shader = Shader(BAKED_SKINNING_VERT, TEXTURE_FRAG)
+
+    def draw(self, projection, view, model, **_kwargs):
+        """ skinning object draw method, only a few uniforms per frame """
+        shader = self.skinning_shader
+        state.use_program(shader.glid)
+
+        # setup camera geometry parameters
+        shader.set_mat4('projection', projection)
+        shader.set_mat4('view', view)
+        shader.set_mat4('model', model)
+
+        # clip rows and time played, the shader interpolates the frames
+        first, frames = self.animation.rows[self.player.active]
+        shader.set_int('clipStart', first)
+        shader.set_int('clipFrames', frames)
+        shader.set_float('rate', self.player.rate)
+        shader.set_float('time', glfw.get_time() - self.player.start)
+
+        # texture access setups
+        shader.set_int('diffuseMap', 0)
+        shader.set_int('animation', 1)
+        state.bind_texture(self.texture.glid, 0)
+        state.bind_texture(self.animation.glid, 1)
+
+        self.vertex_array.draw()
+
+    def print_pretty(self, indent="") :
+        print(indent, self)
+
+
+class BakedClipPlayer(SkinningControlNode):
+    """
+    Root of a skinned model playing the clips of a ClipLibrary from animation
+    textures sampled at load time: the skeleton below the root is no longer
+    evaluated nor uploaded each frame. The root keeps its own keyframes, so
+    owners can still move the model as with the library root.
+    """
+    def __init__(self, library, rate=ANIMATION_RATE):
+        root = library.root
+        super().__init__(None, name=root.name, transform=root.transform)
+        self.rate, self.start = rate, 0
+        self.active = library.active or next(iter(library.clips))
+
+        # transforms relative to the root of every node, for every clip frame
+        samples = {name: sample_clip(root, clip, library.rest, rate)
+                   for name, clip in library.clips.items()}
+
+        # one texture per textured skinned mesh, holding its palettes of every clip
+        for mesh in (mesh for mesh in library.meshes if hasattr(mesh, 'texture')):
+            palettes = {}
+            for name, (transforms, nodes) in samples.items():
+                index = {node: column for column, node in enumerate(nodes)}
+                bones = [index[node] for node in mesh.bone_nodes]
+                palettes[name] = transforms[:, bones] @ mesh.bone_offsets
+            self.add(BakedSkinnedMesh(mesh, AnimationTexture(palettes), self))
+
+        size = sum(child.animation.nbytes for child in self.children)
+        print('Baked %d clips at %d fps\t(%d meshes, %.1f MB)' %
+              (len(samples), rate, len(self.children), size / 2**20))
+
+    def play(self, name):
+        """ make a clip the active animation, from its start """
+        self.active, self.start = name, glfw.get_time()
+
+    def reset_time(self):
+        """ restart the root keys and the active clip, as for the library root """
+        super().reset_time()
+        self.start = self.time
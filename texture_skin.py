@@ -1,9 +1,10 @@
-import pyassimp
 
 from mesh import *
 from node import *
 from texture import *
-from skinning import SkinningControlNode
+from skinning import SkinningControlNode, SKINNED_BOUNDS_SCALE, make_skeleton, mesh_bone_weights
+from bake import POSTPROCESS, load_scene
+from cache import cached_loader
 
 # -------------- Linear Blend Skinning : TP7 ---------------------------------
 MAX_VERTEX_BONES = 4
@@ -71,37 +72,36 @@ class SkinnedMesh:
         # setup shader attributes for linear blend skinning shader
         self.vertex_array = VertexArray(attributes, index)
 
+        # bind pose bounds, enlarged since animation moves the vertices around
+        center, radius = self.vertex_array.bounds
+        self.bounds = center, radius * SKINNED_BOUNDS_SCALE
+
         # feel free to move this up in Viewer as shown in previous practicals
         self.skinning_shader = Shader(SKINNING_VERT, COLOR_FRAG)
 
-        # store skinning data
-        self.bone_nodes = bone_nodes
-        self.bone_offsets = bone_offsets
+        # store skinning data, offsets stacked for the palette computation
+        self.bone_nodes = bone_nodes[:MAX_BONES]
+        self.bone_offsets = np.array(bone_offsets[:MAX_BONES], np.float32).reshape(-1, 4, 4)
 
     def draw(self, projection, view, _model, **_kwargs):
         """ skinning object draw method """
 
         shid = self.skinning_shader.glid
-        GL.glUseProgram(shid)
+        state.use_program(shid)
 
         # setup camera geometry parameters
-        loc = GL.glGetUniformLocation(shid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
-        loc = GL.glGetUniformLocation(shid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-
-        # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
+        self.skinning_shader.set_mat4('projection', projection)
+        self.skinning_shader.set_mat4('view', view)
 
-            bone_loc = GL.glGetUniformLocation(shid, 'boneMatrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, 1, True, bone_matrix)
+        # bone world transform matrices need to be passed for skinning,
+        # computed as one (N, 4, 4) palette and uploaded in a single call
+        if self.bone_nodes:
+            worlds = np.array([node.world_transform for node in self.bone_nodes], np.float32)
+            self.skinning_shader.set_mat4('boneMatrix', worlds @ self.bone_offsets)
 
         # draw mesh vertex array
         self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # leave with clean OpenGL state, to make it easier to detect problems
-        GL.glUseProgram(0)
     def print_pretty(self, indent="") :
         print(indent, self)
 
@@ -112,149 +112,102 @@ class TexturedSkinnedMesh:
 
         # setup shader attributes for linear blend skinning shader
         self.vertex_array = VertexArray(attributes, index)
+
+        # bind pose bounds, enlarged since animation moves the vertices around
+        center, radius = self.vertex_array.bounds
+        self.bounds = center, radius * SKINNED_BOUNDS_SCALE
         self.texture = texture
 
         # feel free to move this up in Viewer as shown in previous practicals
         self.skinning_shader = Shader(SKINNING_VERT, TEXTURE_FRAG)
 
 
-        # store skinning data
-        self.bone_nodes = bone_nodes
-        self.bone_offsets = bone_offsets
+        # store skinning data, offsets stacked for the palette computation
+        self.bone_nodes = bone_nodes[:MAX_BONES]
+        self.bone_offsets = np.array(bone_offsets[:MAX_BONES], np.float32).reshape(-1, 4, 4)
 
     def draw(self, projection, view, _model, **_kwargs):
         """ skinning object draw method """
 
         shid = self.skinning_shader.glid
-        GL.glUseProgram(shid)
+        state.use_program(shid)
 
         # setup camera geometry parameters
-        loc = GL.glGetUniformLocation(shid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
-        loc = GL.glGetUniformLocation(shid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-
-        # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
+        self.skinning_shader.set_mat4('projection', projection)
+        self.skinning_shader.set_mat4('view', view)
 
-            bone_loc = GL.glGetUniformLocation(shid, 'boneMatrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, 1, True, bone_matrix)
+        # bone world transform matrices need to be passed for skinning,
+        # computed as one (N, 4, 4) palette and uploaded in a single call
+        if self.bone_nodes:
+            worlds = np.array([node.world_transform for node in self.bone_nodes], np.float32)
+            self.skinning_shader.set_mat4('boneMatrix', worlds @ self.bone_offsets)
 
         # texture access setups
-        loc = GL.glGetUniformLocation(shid, 'diffuseMap')
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(loc, 0)
+        self.skinning_shader.set_int('diffuseMap', 0)
+        state.bind_texture(self.texture.glid, 0)
 
         self.vertex_array.draw()
 
-        # leave with clean OpenGL state, to make it easier to detect problems
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
-
     def print_pretty(self, indent="") :
         print(indent, self)
 
 
 # -------------- 3D resource loader -------------------------------------------
-def load_textured_skinned(file):
-    """load resources from file using pyassimp, return node hierarchy """
-    try:
-        option = pyassimp.postprocess.aiProcessPreset_TargetRealtime_MaxQuality
-        scene = pyassimp.load(file, option)
-    except pyassimp.errors.AssimpError:
-        print('ERROR: pyassimp unable to load', file)
+@cached_loader
+def load_textured_skinned(file, option=POSTPROCESS, priority=PRIORITY_LOW):
+    """load resources from file, return node hierarchy, textures loaded with
+    the given budget priority.
+    The hierarchy is shared by every caller, animation state included """
+    scene = load_scene(file, option)
+    if scene is None:
         return []
 
-    # ----- load animations
-    def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.time / ticks_per_second: key.value for key in assimp_keys}
-
-    # load first animation in scene file (could be a loop over all animations)
-    transform_keyframes = {}
-    if scene.animations:
-        anim = scene.animations[0]
-        for channel in anim.channels:
-            # for each animation bone, store trs dict with {times: transforms}
-            # (pyassimp name storage bug, bytes instead of str => convert it)
-            transform_keyframes[channel.nodename.data.decode('utf-8')] = (
-                conv(channel.positionkeys, anim.tickspersecond),
-                conv(channel.rotationkeys, anim.tickspersecond),
-                conv(channel.scalingkeys, anim.tickspersecond)
-            )
-
-    # ---- prepare scene graph nodes
-    # create SkinningControlNode for each assimp node.
-    # node creation needs to happen first as SkinnedMeshes store an array of
-    # these nodes that represent their bone transforms
-    nodes = {}  # nodes: string name -> node dictionary
-
-    def make_nodes(pyassimp_node):
-        """ Recursively builds nodes for our graph, matching pyassimp nodes """
-        trs_keyframes = transform_keyframes.get(pyassimp_node.name, (None,))
-
-        node = SkinningControlNode(*trs_keyframes, name=pyassimp_node.name,
-                                   transform=pyassimp_node.transformation)
-        nodes[pyassimp_node.name] = node, pyassimp_node
-        node.add(*(make_nodes(child) for child in pyassimp_node.children))
-        return node
-
-    root_node = make_nodes(scene.rootnode)
+    root_node, nodes = make_skeleton(scene)
 
     # Note: embedded textures not supported at the moment
     path = os.path.dirname(file)
-    textures=[]
+    names=[]
     for mat in scene.materials:
-        mat.tokens = dict(reversed(list(mat.properties.items())))
-        if 'file' in mat.tokens:  # texture file token
-            tname = mat.tokens['file'].split('/')[-1].split('\\')[-1]
+        if mat['file']:  # texture file token
             # search texture in file's whole subdir since path often screwed up
-            tname = [os.path.join(d[0], f) for d in os.walk(path) for f in d[2]
-                     if tname.startswith(f) or f.startswith(tname)]
-            if tname:
-                textures.append(Texture(tname[0]))
+            name = find_texture(path, mat['file'])
+            if name:
+                names.append(name)
             else:
-                print('Failed to find texture:', tname)
+                print('Failed to find texture:', mat['file'])
+
+    # decode the images of every material at once, then upload them in turn
+    prefetch(*names)
+    textures = [load_texture(name, priority=priority) for name in names]
 
     # ---- create SkinnedMesh objects
+    skinned_meshes = []
     for mesh in scene.meshes:
 
         texture = textures[1]
 
         # tex coords in raster order: compute 1 - y to follow OpenGL convention
-        tex_uv = ((0, 1) + mesh.texturecoords[0][:, :2] * (1, -1)
-                  if mesh.texturecoords.size else None)
+        tex_uv = ((0, 1) + mesh.texcoords * (1, -1)
+                  if mesh.texcoords is not None else None)
 
 
         # -- skinned mesh: weights given per bone => convert per vertex for GPU
-        # first, populate an array with MAX_BONES entries per vertex
-        v_bone = np.array([[(0, 0)]*MAX_BONES] * mesh.vertices.shape[0],
-                          dtype=[('weight', 'f4'), ('id', 'u4')])
-        for bone_id, bone in enumerate(mesh.bones[:MAX_BONES]):
-            for entry in bone.weights:  # weight,id pairs necessary for sorting
-                v_bone[entry.vertexid][bone_id] = (entry.weight, bone_id)
-
-        v_bone.sort(order='weight')             # sort rows, high weights last
-        v_bone = v_bone[:, -MAX_VERTEX_BONES:]  # limit bone size, keep highest
+        # keeping the MAX_VERTEX_BONES highest weights of each vertex
+        v_bone_ids, v_bone_weights = mesh_bone_weights(mesh)
 
         # prepare bone lookup array & offset matrix, indexed by bone index (id)
-        bone_nodes = [nodes[bone.name][0] for bone in mesh.bones]
-        bone_offsets = [bone.offsetmatrix for bone in mesh.bones]
+        bone_nodes = [nodes[name][0] for name in mesh.bone_names]
 
-        # initialize skinned mesh and store in pyassimp_mesh for node addition
-        mesh.skinned_mesh = TexturedSkinnedMesh(texture,
-                [mesh.vertices, tex_uv, mesh.normals, v_bone['id'], v_bone['weight']],
-                bone_nodes, bone_offsets, mesh.faces
-        )
+        skinned_meshes.append(TexturedSkinnedMesh(texture,
+                [mesh.vertices, tex_uv, mesh.normals, v_bone_ids, v_bone_weights],
+                bone_nodes, mesh.bone_offsets, mesh.faces
+        ))
 
-    # ------ add each mesh to its intended nodes as indicated by assimp
-    for final_node, assimp_node in nodes.values():
-        final_node.add(*(_mesh.skinned_mesh for _mesh in assimp_node.meshes))
+    # ------ add each mesh to its intended nodes as indicated by the scene
+    for final_node, baked_node in nodes.values():
+        final_node.add(*(skinned_meshes[index] for index in baked_node.meshes))
 
     nb_triangles = sum((mesh.faces.shape[0] for mesh in scene.meshes))
     print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
-          (len(scene.meshes), nb_triangles, len(nodes), len(scene.animations)))
-    pyassimp.release(scene)
+          (len(scene.meshes), nb_triangles, len(nodes), int(bool(scene.channels))))
     return [root_node]
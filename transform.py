@@ -114,6 +114,84 @@ def lookat(eye, target, up):
     return rotation @ translate(-eye)
 
 
+# Bounding spheres and view frustum culling ----------------------------------
+def bounding_sphere(points):
+    """ (center, radius) sphere enclosing an array of 3d points """
+    points = np.asarray(points, 'f').reshape(-1, np.shape(points)[-1])[:, :3]
+    center = (points.min(axis=0) + points.max(axis=0)) / 2
+    return center, float(np.sqrt(((points - center)**2).sum(axis=1).max()))
+
+
+def merge_spheres(spheres):
+    """ sphere enclosing a list of spheres, None if empty or one is unknown """
+    spheres = list(spheres)
+    if not spheres or any(sphere is None for sphere in spheres):
+        return None
+    centers = np.array([center for center, _ in spheres], 'f')
+    radii = np.array([radius for _, radius in spheres], 'f')
+    center = ((centers - radii[:, None]).min(axis=0) +
+              (centers + radii[:, None]).max(axis=0)) / 2
+    return center, float((np.linalg.norm(centers - center, axis=1) + radii).max())
+
+
+def transform_sphere(matrix, sphere):
+    """ sphere enclosing a sphere transformed by a 4x4 affine matrix """
+    if sphere is None:
+        return None
+    center, radius = sphere
+    scale_factor = np.linalg.norm(matrix[:3, :3], axis=0).max()
+    return matrix[:3, :3] @ center + matrix[:3, 3], float(radius * scale_factor)
+
+
+class Frustum:
+    """ View frustum planes of a projection @ view matrix, counting culled objects """
+
+    def __init__(self, matrix):
+        """ Extract the 6 normalized planes, from rows of the clip matrix """
+        rows = np.asarray(matrix, 'f')
+        planes = np.array([rows[3] + rows[0], rows[3] - rows[0],   # left right
+                           rows[3] + rows[1], rows[3] - rows[1],   # bottom top
+                           rows[3] + rows[2], rows[3] - rows[2]])  # near far
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        self.drawn = self.culled = 0
+
+    def inside(self, centers, radii):
+        """ boolean mask of the (N, 3) centers & (N,) radii spheres not culled,
+            without counting them """
+        distances = np.asarray(centers) @ self.planes[:, :3].T + self.planes[:, 3]
+        return (distances >= -np.asarray(radii)[:, None]).all(axis=1)
+
+    def visible_spheres(self, centers, radii):
+        """ boolean mask of the (N, 3) centers & (N,) radii spheres not culled,
+            each sphere counted as one drawn or culled object """
+        visible = self.inside(centers, radii)
+        self.drawn += int(visible.sum())
+        self.culled += visible.size - int(visible.sum())
+        return visible
+
+    def visible(self, drawable, model):
+        """ test the bounds of a drawable under model, unbounded ones are visible.
+            Only objects are counted: leaves, not the nodes holding them, and
+            nothing for drawables which cull their content themselves """
+        sphere = transform_sphere(model, getattr(drawable, 'bounds', None))
+        visible = sphere is None or bool(self.inside(sphere[0][None], [sphere[1]])[0])
+        if visible:
+            self.drawn += not hasattr(drawable, 'children') and not getattr(drawable, 'culls', False)
+        else:
+            self.culled += leaf_count(drawable)
+        return visible
+
+
+def leaf_count(drawable):
+    """ objects below a drawable, as counted by Frustum: leaves of node
+        subtrees, none for drawables culling their own content """
+    if getattr(drawable, 'culls', False):
+        return 0
+    if not hasattr(drawable, 'children'):
+        return 1
+    return sum(leaf_count(child) for child in drawable.children)
+
+
 # quaternion functions -------------------------------------------------------
 def quaternion(x=vec(0., 0., 0.), y=0.0, z=0.0, w=1.0):
     """ Init quaternion, w=real and, x,y,z or vector x imaginary components """
@@ -1,6 +1,35 @@
+import ctypes
+
+import OpenGL.GL as GL
+import numpy as np
+
+from cache import assets
 from loader import loadColorMesh
+from mesh import COLOR_FRAG
 from node import Node
-from transform import translate
+from shader import Shader
+from render import state
+from transform import translate, merge_spheres
+
+FOREST_VERT = """#version 330 core
+uniform mat4 projection;
+uniform mat4 view;
+uniform vec3 inColor;
+
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec3 normal;
+layout(location = 2) in mat4 instance;
+out vec3 color;
+out vec3 outNormal;
+void main() {
+    gl_Position = projection * view * instance * vec4(position, 1);
+    color = inColor;
+    outNormal = mat3(instance) * normal;
+}"""
+
+# per instance 4x4 transform, given as 4 column attributes after the mesh ones
+INSTANCE_LOCATION = 2
+
 
 class Tree:
 	"""
@@ -13,4 +42,102 @@ class Tree:
 		self.node = Node(transform=translate(x, y, z))
 		self.meshes = loadColorMesh("tree/tree.obj")
 		for mesh in self.meshes:
-			self.node.add(mesh)
\ No newline at end of file
+			self.node.add(mesh)
+
+
+class Forest:
+	"""
+	many trees sharing one geometry, drawn with one instanced call per sub-mesh
+	"""
+	culls = True	# trees culled and counted one by one
+	def __init__(self, file="tree/tree.obj"):
+		"""
+		load the tree meshes once and prepare the instance transform buffer
+		"""
+		self.shader = Shader(FOREST_VERT, COLOR_FRAG)
+		self.meshes = loadColorMesh(file)
+		self.transforms = np.empty((0, 4, 4), np.float32)
+		self.visible = None
+		self.count = 0
+
+		#Instance buffer bound after the mesh attributes of every sub-mesh, in
+		#vertex arrays of our own since the meshes are shared through the cache
+		self.buffer = GL.glGenBuffers(1)
+		self.vertexArrays = []
+		for mesh in self.meshes:
+			self.vertexArrays.append(mesh.share())
+			GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+			for column in range(4):
+				location = INSTANCE_LOCATION + column
+				GL.glEnableVertexAttribArray(location)
+				GL.glVertexAttribPointer(location, 4, GL.GL_FLOAT, False, 64,
+				                         ctypes.c_void_p(16*column))
+				GL.glVertexAttribDivisor(location, 1)
+		state.bind_vertex_array(0)
+		GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+		#Bounding sphere of one tree, in its own frame
+		self.treeBounds = merge_spheres(mesh.bounds for mesh in self.meshes)
+		self.bounds = None
+
+	def add(self, *transforms):
+		"""
+		add trees placed by 4x4 transforms
+		"""
+		transforms = np.array(transforms, np.float32).reshape(-1, 4, 4)
+		self.transforms = np.concatenate((self.transforms, transforms))
+		if self.treeBounds is None:
+			return
+		center, radius = self.treeBounds
+		self.centers = self.transforms[:, :3, :3] @ center + self.transforms[:, :3, 3]
+		self.radii = radius * np.linalg.norm(self.transforms[:, :3, :3], axis=1).max(axis=1)
+		self.bounds = merge_spheres(zip(self.centers, self.radii))
+		self.visible = None
+
+	def upload(self, visible):
+		"""
+		upload the transforms of the visible trees, columns first for GLSL
+		"""
+		transforms = np.ascontiguousarray(self.transforms[visible].transpose(0, 2, 1))
+		GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer)
+		GL.glBufferData(GL.GL_ARRAY_BUFFER, transforms, GL.GL_DYNAMIC_DRAW)
+		GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+		self.visible, self.count = visible, len(transforms)
+
+	def draw(self, projection, view, model, win=None, frustum=None, **_kwargs):
+		"""
+		draws every visible tree, the instance buffer is only updated when
+		the set of trees in the view frustum changes
+		"""
+		visible = np.ones(len(self.transforms), dtype=bool)
+		if frustum is not None and self.bounds is not None:
+			scale_factor = np.linalg.norm(model[:3, :3], axis=0).max()
+			centers = self.centers @ model[:3, :3].T + model[:3, 3]
+			visible = frustum.visible_spheres(centers, self.radii * scale_factor)
+		if self.visible is None or not np.array_equal(visible, self.visible):
+			self.upload(visible)
+		if not self.count:
+			return
+
+		state.use_program(self.shader.glid)
+		self.shader.set_mat4('projection', projection)
+		self.shader.set_mat4('view', view @ model)
+		for mesh, vertexArray in zip(self.meshes, self.vertexArrays):
+			self.shader.set_vec3('inColor', mesh.color)
+			state.bind_vertex_array(vertexArray)
+			GL.glDrawElementsInstanced(GL.GL_TRIANGLES, mesh.size, GL.GL_UNSIGNED_INT,
+			                           None, self.count)
+			state.count_draw(mesh.size, self.count)
+
+	def on_key(self, _win, key, _scancode, action, _mods):
+		"""
+		catch no event
+		"""
+		pass
+
+	def __del__(self):
+		for vertexArray in self.vertexArrays:
+			state.forget_vertex_array(vertexArray)
+		GL.glDeleteVertexArrays(len(self.vertexArrays), self.vertexArrays)
+		GL.glDeleteBuffers(1, [self.buffer])
+		assets.release(self.meshes)
@@ -11,6 +11,7 @@ import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 from transform import translate, rotate, scale, frustum, perspective, GLFWTrackball, identity, lerp, vec
 from transform import vec as vect
+from transform import Frustum
 import pyassimp                     # 3D ressource loader
 import pyassimp.errors              # assimp error management + exceptions
 from PIL import Image
@@ -19,26 +20,33 @@ from transform import (quaternion_slerp, quaternion_matrix, quaternion,
 from loader import *
 from node import*
 from skybox import Skybox
+from shader import Shader
+from render import RenderQueue, state
+from profiler import profiler
+from startup import startup
+from texture import streamer
 
 # ------------  Viewer class & window management ------------------------------
 class Viewer:
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, width=1000, height=1000, skybox=None):
+    def __init__(self, width=1000, height=1000, skybox=None, visible=True):
         self.y_angle = 0
         self.x_angle = 0
         self.fill_modes = cycle([GL.GL_LINE, GL.GL_POINT, GL.GL_FILL])
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
-        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
-        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
-        glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
-        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-        glfw.window_hint(glfw.RESIZABLE, False)
-        self.win = glfw.create_window(width, height, 'Viewer', None, None)
-
-        # make win's OpenGL context current; no OpenGL calls can happen before
-        glfw.make_context_current(self.win)
+        with startup.phase('context'):
+            glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+            glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+            glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+            glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+            glfw.window_hint(glfw.RESIZABLE, False)
+            glfw.window_hint(glfw.VISIBLE, visible)    # hidden for headless benchmarks
+            self.win = glfw.create_window(width, height, 'Viewer', None, None)
+
+            # make win's OpenGL context current; no OpenGL calls can happen before
+            glfw.make_context_current(self.win)
 
         # register event handl  ers
         glfw.set_key_callback(self.win, self.on_key)
@@ -54,35 +62,87 @@ class Viewer:
 
         GL.glEnable(GL.GL_CULL_FACE)
         GL.glEnable(GL.GL_DEPTH_TEST)
-        self.skybox =  Skybox("skybox2.jpg")
+        with startup.phase('skybox'):
+            self.skybox =  Skybox("skybox2.jpg")
         # initially empty list of object to draw
         self.drawables = []
 
+        # objects drawn and culled by the view frustum during the last frame
+        self.drawn = self.culled = 0
+
+        # uniform uploads done and skipped as redundant during the last frame
+        self.uniform_uploads = self.uniform_skipped = 0
+
+        # node world transforms recomputed during the last frame
+        self.transform_updates = 0
+
+        # draw items sorted by GL state, and GL binds issued during the last frame
+        self.queue = RenderQueue()
+        self.binds = dict(state.binds)
+
+        # draw calls issued and triangles drawn during the last frame
+        self.draws = self.triangles = 0
+
     def run(self, observable):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
-            # clear draw buffer
-            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+            self.frame(observable)
 
-            # draw our scene objects
+        if profiler.enabled and profiler.trace_path:
+            profiler.export(profiler.trace_path)
 
+    def frame(self, observable):
+        """ render, present and process the events of one frame """
+        profiler.begin_frame()
+        draws, triangles = state.draws, state.triangles
+
+        # next rows of the textures still streaming to the GPU
+        with profiler.stage('stream'):
+            streamer.update()
+
+        # clear draw buffer
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+
+        # draw our scene objects
+        with profiler.stage('update'):
             winsize = glfw.get_window_size(self.win)
             view = self.trackball.view_matrix()
             projection = self.trackball.projection_matrix(winsize)
             model = translate(0, -100, -100) @ np.linalg.inv(observable.mesh.transform)
 
+        with profiler.stage('skybox'):
             if self.skybox is not None:
                 self.skybox.drawskybox(projection, view)
 
+        # skip the drawables and subtrees outside of the view frustum
+        uploads, skipped, updates = Shader.uploads, Shader.skipped, Node.updates
+        binds = dict(state.binds)
+        with profiler.stage('cull'):
+            frustum = Frustum(projection @ view)
             for drawable in self.drawables:
-                drawable.draw(projection, view, model, win=self.win)
-
-            # flush render commands, and swap draw buffers
+                if getattr(drawable, 'animated', False):
+                    drawable.animate(self.win)
+                if frustum.visible(drawable, model):
+                    self.queue.add(drawable, projection, view, model, win=self.win, frustum=frustum)
+        with profiler.stage('draw'):
+            self.queue.submit(projection, view)
+        self.binds = {kind: state.binds[kind] - binds[kind] for kind in binds}
+        self.drawn, self.culled = frustum.drawn, frustum.culled
+        self.uniform_uploads = Shader.uploads - uploads
+        self.uniform_skipped = Shader.skipped - skipped
+        self.transform_updates = Node.updates - updates
+        self.draws, self.triangles = state.draws - draws, state.triangles - triangles
+
+        # flush render commands, and swap draw buffers
+        with profiler.stage('swap'):
             glfw.swap_buffers(self.win)
 
-            # Poll for and process events
+        # Poll for and process events
+        with profiler.stage('input'):
             glfw.poll_events()
 
+        profiler.end_frame()
+
     def add(self, *drawables):
         """ add objects to draw in this window """
         self.drawables.extend(drawables)
@@ -98,6 +158,8 @@ class Viewer:
                 glfw.set_window_should_close(self.win, True)
             if key == glfw.KEY_W:
                 GL.glPolygonMode(GL.GL_FRONT_AND_BACK, next(self.fill_modes))
+            if key == glfw.KEY_P and action == glfw.PRESS:
+                profiler.enabled = not profiler.enabled
             if key == glfw.KEY_SPACE:
                 pass
                 # glfw.set_time(0)